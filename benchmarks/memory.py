@@ -0,0 +1,88 @@
+# -----------------------------
+# ПИКОВАЯ ПАМЯТЬ ПРИ РЕНДЕРЕ ОТЧЁТА С ФОТОГРАФИЯМИ
+# -----------------------------
+# Пример: python benchmarks/memory.py --photos 60
+#
+# Генерирует синтетические «фото с телефона» (4000x3000 JPEG с шумом),
+# раскладывает их по фото объекта и пяти аналогам и рендерит отчёт через
+# ocenka.render.render_report в отдельном процессе. Печатает пиковый RSS
+# процесса (ru_maxrss), время и размер DOCX. Кеш изображений отключён.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = r"""
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+from ocenka.cli import DirectoryFiles
+from ocenka.render import render_report
+record = json.loads(sys.argv[3])
+started = time.perf_counter()
+data = render_report(record, DirectoryFiles(sys.argv[2]))
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "docx_bytes": len(data),
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def make_photos(directory: Path, count: int, width: int, height: int):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    names = []
+    for idx in range(count):
+        name = f"photo_{idx:03d}.jpg"
+        Image.fromarray(np.roll(base, idx * 37, axis=1)).save(directory / name, quality=90)
+        names.append(name)
+    return names
+
+
+def build_record(names, analogs=5):
+    object_count = len(names) - len(names) * 2 // 3
+    rest = names[object_count:]
+    per_analog = max(1, len(rest) // analogs) if rest else 0
+    return {
+        "user_uuid": "0000000",
+        "Номер договора": "bench",
+        "Фотографии объекта": names[:object_count],
+        "Объекты-аналоги": [
+            {"Номер": idx + 1, "Название": f"Аналог {idx + 1}", "Файлы": rest[idx * per_analog:(idx + 1) * per_analog]}
+            for idx in range(analogs)
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пиковый RSS при рендере отчёта с синтетическими фото.")
+    parser.add_argument("--photos", type=int, default=60)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        names = make_photos(Path(tmp), args.photos, args.width, args.height)
+        total = sum(os.path.getsize(Path(tmp) / name) for name in names)
+        env = dict(os.environ, OCENKA_IMAGE_CACHE_MB="0")
+        out = subprocess.run(
+            [sys.executable, "-c", CHILD, str(ROOT), tmp, json.dumps(build_record(names), ensure_ascii=False)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    print(f"Фото: {args.photos} шт., {total / 1024 / 1024:.0f} МБ исходников")
+    print(f"Пиковый RSS: {result['peak_rss_mb']:.0f} МБ")
+    print(f"Время рендера: {result['seconds']:.1f} с, DOCX: {result['docx_bytes'] / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
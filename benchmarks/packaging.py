@@ -0,0 +1,102 @@
+# -----------------------------
+# УПАКОВКА DOCX: doc.save ПРОТИВ write_docx
+# -----------------------------
+# Пример: python benchmarks/packaging.py                 (все отчёты в generated/)
+#         python benchmarks/packaging.py a.docx --levels 1 6 9
+#
+# Каждый отчёт открывается python-docx и сохраняется в память двумя путями:
+#   doc.save   — как раньше, deflate на все части;
+#   write_docx — картинки без сжатия, XML — deflate заданного уровня;
+#   и запасной путь write_docx, когда внутренних методов python-docx нет
+#   или у них другая сигнатура (сохраняет doc.save, файл должен открываться).
+# Печатает медиану времени сохранения и размер файла.
+import argparse
+import io
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def measure(save, path, repeat):
+    from docx import Document
+
+    times = []
+    size = 0
+    for _ in range(repeat):
+        doc = Document(str(path))
+        buffer = io.BytesIO()
+        started = time.perf_counter()
+        save(doc, buffer)
+        times.append(time.perf_counter() - started)
+        size = len(buffer.getvalue())
+    return statistics.median(times), size
+
+
+@contextmanager
+def patched_package_writer(api):
+    # как в версии python-docx, где внутренние методы переименованы (None)
+    # или у них другая сигнатура
+    import ocenka.output as output
+
+    saved = output._package_writer
+    output._package_writer = lambda: api
+    try:
+        yield
+    finally:
+        output._package_writer = saved
+
+
+def _wrong_signature(writer, parts, extra):
+    pass
+
+
+def check_fallback(path):
+    # запасной путь write_docx -> открываемый DOCX; -> размер
+    from docx import Document
+
+    from ocenka.output import write_docx
+
+    size = 0
+    for api in (None, (_wrong_signature,) * 3):
+        buffer = io.BytesIO()
+        with patched_package_writer(api):
+            write_docx(Document(str(path)), buffer)
+        Document(io.BytesIO(buffer.getvalue()))
+        size = len(buffer.getvalue())
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время и размер сохранения DOCX.")
+    parser.add_argument("paths", nargs="*", help="отчёты DOCX (по умолчанию generated/*.docx)")
+    parser.add_argument("--levels", type=int, nargs="+", default=[6], help="уровни deflate для XML")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from ocenka.output import write_docx
+
+    paths = [Path(p) for p in args.paths] or sorted((ROOT / "generated").glob("*.docx"))
+    if not paths:
+        print("Нет отчётов для замера.")
+        return 1
+    for path in paths:
+        print(path.name)
+        base_time, base_size = measure(lambda doc, out: doc.save(out), path, args.repeat)
+        print(f"  doc.save:         {base_time:6.3f} с  {base_size / 1024:8.0f} КБ")
+        for level in args.levels:
+            seconds, size = measure(lambda doc, out: write_docx(doc, out, level), path, args.repeat)
+            print(f"  write_docx (x{level}):  {seconds:6.3f} с  {size / 1024:8.0f} КБ"
+                  f"  ({seconds / base_time:.0%} времени, {size / base_size:.1%} размера)")
+        size = check_fallback(path)
+        print(f"  запасной путь:    {'совпадает с doc.save' if size == base_size else 'размер другой'}"
+              f"  {size / 1024:8.0f} КБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
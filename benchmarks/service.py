@@ -0,0 +1,111 @@
+# -----------------------------
+# ПРОПУСКНАЯ СПОСОБНОСТЬ: РЕНДЕР В ПРОЦЕССЕ ПРОТИВ СЕРВИСА
+# -----------------------------
+# Пример: python benchmarks/service.py --clients 1 4 16 --workers 4
+#
+# Один и тот же синтетический отчёт (фото объекта и пяти аналогов)
+# рендерится N параллельными клиентами:
+#   в процессе — потоки вызывают ocenka.render.render_report, как рендер
+#                внутри реплики Streamlit;
+#   сервис     — потоки отправляют запись и файлы в python -m ocenka.service
+#                с --workers процессами (шаблон в воркерах уже прогрет).
+# Печатает отчёты в секунду и задержку p50/p95. Кеш изображений отключён,
+# чтобы каждое фото честно обрабатывалось заново.
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ["OCENKA_IMAGE_CACHE_MB"] = "0"
+# воркеры сервиса не пишут замеры бенчмарка в боевой журнал
+os.environ["OCENKA_METRICS_LOG"] = os.devnull
+
+from memory import build_record, make_photos  # noqa: E402
+
+
+def run_clients(render_one, clients, renders):
+    latencies = []
+
+    def task(_idx):
+        started = time.perf_counter()
+        render_one()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(task, range(renders)))
+    return renders / (time.perf_counter() - started), latencies
+
+
+def start_service(workers):
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "ocenka.service", "--port", "0", "--workers", str(workers)],
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True,
+    )
+    line = proc.stdout.readline()
+    if not line.startswith("Сервис рендера:"):
+        proc.kill()
+        raise RuntimeError(f"сервис не запустился: {line!r}")
+    return proc, line.split()[2].rstrip(",")
+
+
+def _fmt(throughput, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))]
+    return f"{throughput:6.2f} отч/с, p50 {statistics.median(latencies):6.2f} с, p95 {p95:6.2f} с"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Рендер в процессе против сервиса рендера.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--renders", type=int, default=16, help="отчётов на каждый уровень параллельности")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="воркеров сервиса")
+    parser.add_argument("--photos", type=int, default=12)
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    args = parser.parse_args(argv)
+
+    from ocenka.cli import DirectoryFiles
+    from ocenka.render import TEMPLATE_PATH, render_report
+    from ocenka.service import RenderClient
+    from ocenka.template_cache import template_cache
+
+    with tempfile.TemporaryDirectory() as tmp:
+        names = make_photos(Path(tmp), args.photos, args.width, args.height)
+        record = build_record(names)
+        files = [(name, (Path(tmp) / name).read_bytes()) for name in names]
+        template_cache.warm(TEMPLATE_PATH)
+
+        def in_process():
+            render_report(record, DirectoryFiles(tmp))
+
+        proc, url = start_service(args.workers)
+        try:
+            client = RenderClient(url)
+
+            def via_service():
+                client.render(record, files)
+
+            print(f"Фото: {args.photos} шт. {args.width}x{args.height}, отчётов на уровень: {args.renders}, "
+                  f"воркеров сервиса: {args.workers}")
+            for clients in args.clients:
+                renders = max(args.renders, clients)
+                print(f"Клиентов: {clients}")
+                print(f"  в процессе: {_fmt(*run_clients(in_process, clients, renders))}")
+                print(f"  сервис:     {_fmt(*run_clients(via_service, clients, renders))}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
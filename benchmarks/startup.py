@@ -0,0 +1,103 @@
+# -----------------------------
+# БЕНЧМАРК ЗАПУСКА И ПЕРЕЗАПУСКОВ СКРИПТА
+# -----------------------------
+# Пример: python benchmarks/startup.py --runs 20
+#
+# 1. Холодный импорт: каждый набор модулей импортируется в отдельном свежем
+#    процессе (лучшее из --cold-runs).
+# 2. Перезапуск скрипта: main.py гоняется через streamlit.testing.AppTest
+#    (авторизация уже пройдена), замеряется первый прогон, перезапуск без
+#    изменений и нажатие «➕ Добавить объект-аналог» (add_analog_slot).
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SETS = {
+    "streamlit": ["streamlit"],
+    "модули приложения (main.py)": ["ocenka.deps", "ocenka.output", "ocenka.images", "ocenka.render"],
+    "документные библиотеки (при рендере)": ["docx", "docxtpl", "lxml.etree", "ocenka.template_cache"],
+}
+
+
+def cold_import_seconds(modules, runs):
+    code = (
+        "import time\n"
+        "t = time.perf_counter()\n"
+        + "".join(f"import {name}\n" for name in modules)
+        + "print(time.perf_counter() - t)\n"
+    )
+    best = None
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        value = float(out.strip().splitlines()[-1])
+        best = value if best is None else min(best, value)
+    return best
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def _find_button(at, label_part):
+    for button in at.button:
+        if label_part in (button.label or ""):
+            return button
+    raise LookupError(label_part)
+
+
+def rerun_seconds(runs):
+    from streamlit.testing.v1 import AppTest
+
+    sys.path.insert(0, str(ROOT))
+    at = AppTest.from_file(str(ROOT / "main.py"), default_timeout=120)
+    at.session_state["auth_ok"] = True
+    at.session_state["user_name"] = "bench"
+    at.session_state["user_login"] = "bench"
+    at.session_state["uuid7"] = "0000000"
+
+    first = _timed(at.run)
+    plain = [_timed(at.run) for _ in range(runs)]
+
+    add_analog = []
+    for _ in range(runs):
+        if len(at.session_state["analog_slots"]) >= 2:
+            at.session_state["analog_slots"] = [1]
+        button = _find_button(at, "Добавить объект-аналог")
+        add_analog.append(_timed(button.click().run))
+    return first, plain, add_analog
+
+
+def _fmt(values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return f"медиана {statistics.median(values) * 1000:.1f} мс, p95 {p95 * 1000:.1f} мс"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время холодного импорта и перезапусков main.py.")
+    parser.add_argument("--runs", type=int, default=20, help="число перезапусков скрипта")
+    parser.add_argument("--cold-runs", type=int, default=5, help="число свежих процессов на импорт")
+    args = parser.parse_args(argv)
+
+    print("Холодный импорт (лучшее из свежих процессов):")
+    for title, modules in IMPORT_SETS.items():
+        print(f"  {title}: {cold_import_seconds(modules, args.cold_runs) * 1000:.0f} мс")
+
+    first, plain, add_analog = rerun_seconds(args.runs)
+    print("Прогоны main.py (AppTest):")
+    print(f"  первый прогон: {first * 1000:.0f} мс")
+    print(f"  перезапуск без изменений: {_fmt(plain)}")
+    print(f"  добавление объекта-аналога: {_fmt(add_analog)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,61 @@
 ﻿# -----------------------------
-# АВТОУСТАНОВКА ЗАВИСИМОСТЕЙ ИЗ requirements.txt (жёстко, без --user)
+# ПРОВЕРКА ЗАВИСИМОСТЕЙ (без pip: установка — при развёртывании)
 # -----------------------------
-import subprocess, sys, os, tempfile
+import os
 import streamlit as st
 
-def install_requirements_strict(req_path: str):
-    env = os.environ.copy()
-    # игнорируем пользовательские pip-конфиги
-    empty_cfg = os.path.join(tempfile.gettempdir(), "empty_pip.cfg")
-    if not os.path.exists(empty_cfg):
-        with open(empty_cfg, "w", encoding="utf-8") as f:
-            f.write("")
-    env["PIP_CONFIG_FILE"] = empty_cfg
-    env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
-    env.pop("PIP_USER", None)
-    env.pop("PIP_TARGET", None)
-    env.pop("PYTHONUSERBASE", None)
-
-    cmd = [sys.executable, "-m", "pip", "install", "-r", req_path]
-    subprocess.check_call(cmd, env=env)
+from ocenka.deps import check_requirements
 
 if "reqs_installed" not in st.session_state:
     req_path = os.path.join(os.path.dirname(__file__), "requirements.txt")
-    if os.path.exists(req_path):
-        try:
-            install_requirements_strict(req_path)
-            st.session_state["reqs_installed"] = True
-        except subprocess.CalledProcessError as e:
-            print("Ошибка при установке зависимостей:", e)
-            st.error("Не удалось установить зависимости. См. терминал.")
+    missing_reqs = check_requirements(req_path)
+    if missing_reqs:
+        print("Не хватает зависимостей:", "; ".join(missing_reqs))
+        st.error(
+            "Не хватает зависимостей: " + "; ".join(missing_reqs)
+            + ". Установите их командой `pip install -r requirements.txt`."
+        )
     else:
         st.session_state["reqs_installed"] = True
 
 # -----------------------------
 # ИМПОРТЫ И НАСТРОЙКИ
 # -----------------------------
-import io
+import json
 import random
-import math
 from datetime import date
-from pathlib import Path
 
-from docx.shared import Inches
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from ocenka.archive import new_report_id
+from ocenka.drafts import draft_store
+from ocenka.jobs import QueueFull, render_queue
+from ocenka.metrics import (
+    RenderTrace,
+    format_cache_rate,
+    format_summary,
+    read_recent,
+    sum_counters,
+    summarize,
+)
+from ocenka.profiling import PROFILE_ALWAYS
+from ocenka.store import appraisal_store, attachments_from_report
+from ocenka.thumbnails import thumbnail_cache
+from ocenka.uploads import ingest_upload
+from ocenka.render import (
+    ANALOG_EMPTY_TITLE,
+    TEMPLATE_PATH,
+    default_analog_heading,
+    format_analog_source_text,
+    report_file_name,
+    warm_up_async,
+)
 
 st.set_page_config(page_title="Оценка авто — MVP", layout="centered")
 
-
-def build_photos_subdoc(doc, files, per_row=2, empty_message="Фотографии не загружены."):
-    subdoc = doc.new_subdoc()
-    if not files:
-        if empty_message:
-            subdoc.add_paragraph(empty_message)
-        return subdoc
-    rows = math.ceil(len(files) / per_row)
-    table = subdoc.add_table(rows=rows, cols=per_row)
-    table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    idx = 0
-    for r in range(rows):
-        for c in range(per_row):
-            cell = table.cell(r, c)
-            for paragraph in cell.paragraphs:
-                paragraph.text = ""
-            if idx < len(files):
-                image_stream = io.BytesIO(files[idx]['data'])
-                run = cell.paragraphs[0].add_run()
-                run.add_picture(image_stream, width=Inches(3.0))
-                cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-                idx += 1
-    return subdoc
-
 DEFAULT_CONTRACTOR = "ООО «Агентство «Бизнес-Актив»"
-TEMPLATE_NAME = "mers_ocenka.docx"   # имя файла шаблона
-TEMPLATES_DIR = Path(__file__).parent / "templates"
-GENERATED_DIR = Path(__file__).parent / "generated"
-GENERATED_DIR.mkdir(exist_ok=True)
+# логины через запятую, которым в сайдбаре видна сводка замеров рендера
+ADMIN_LOGINS = {
+    login.strip() for login in os.environ.get("OCENKA_ADMIN_LOGINS", "").split(",") if login.strip()
+}
 
 # -----------------------------
 # УТИЛИТЫ
@@ -87,52 +66,6 @@ def generate_uuid7() -> str:
 def safe_str_date(d: date) -> str:
     return d.strftime("%d.%m.%Y") if isinstance(d, date) else str(d)
 
-def summarize_attachments(files, failures):
-    lines = []
-    if files:
-        for idx, item in enumerate(files, start=1):
-            lines.append(f"{idx}. {item['name']}")
-    if failures:
-        lines.append("Не удалось загрузить: " + ', '.join(failures))
-    if not lines:
-        return "Файлы не загружены."
-    return '\n'.join(lines)
-
-
-IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
-
-
-def _is_image_file(name: str) -> bool:
-    return Path(name or '').suffix.lower() in IMAGE_SUFFIXES
-
-
-def build_appendix_entries(doc, files, failures):
-    from docxtpl import InlineImage
-    from docx.shared import Mm
-
-    entries = []
-
-    for item in files:
-        display_name = item.get('name', 'без названия')
-        if not _is_image_file(display_name):
-            continue
-        try:
-            image_stream = io.BytesIO(item['data'])
-            image_stream.seek(0)
-            image_stream.name = display_name
-            img = InlineImage(doc, image_stream, width=Mm(140))
-        except Exception as exc:
-            failures.append(f"{display_name} (ошибка вставки: {exc})")
-            continue
-        entries.append({'image': img})
-
-    return entries
-
-
-ANALOG_EMPTY_TITLE = "без названия"
-MAX_ANALOGS = 10
-ANALOG_TITLE_TEMPLATE = "Предложение по продаже транспортного средства (объект-аналог №{index})"
-
 
 def ensure_analog_state():
     slots = st.session_state.setdefault("analog_slots", [1])
@@ -143,8 +76,6 @@ def ensure_analog_state():
 def add_analog_slot():
     ensure_analog_state()
     slots = list(st.session_state["analog_slots"])
-    if len(slots) >= MAX_ANALOGS:
-        return
     counter = st.session_state.get("analog_counter", 0) + 1
     st.session_state["analog_counter"] = counter
     slots.append(counter)
@@ -157,106 +88,9 @@ def remove_analog_slot(slot_id: int):
     st.session_state.pop(f"analog_title_{slot_id}", None)
     st.session_state.pop(f"analog_files_{slot_id}", None)
     st.session_state.pop(f"analog_source_{slot_id}", None)
+    st.session_state.get("draft_files", {}).pop(f"analog_files_{slot_id}", None)
 
 
-def default_analog_heading(index: int) -> str:
-    return ANALOG_TITLE_TEMPLATE.format(index=index)
-
-
-def format_analog_source_text(text: str) -> str:
-    cleaned = (text or "").strip()
-    if not cleaned:
-        return ""
-    lower_cleaned = cleaned.lower()
-    prefix = "источник информации"
-    if lower_cleaned.startswith(prefix):
-        return cleaned
-    if not cleaned.startswith("(") and not cleaned.endswith(")"):
-        cleaned = f"({cleaned})"
-    return f"Источник информации: {cleaned}"
-
-
-def format_analog_source(text: str):
-    formatted = format_analog_source_text(text)
-    if not formatted:
-        return ""
-    from docxtpl import RichText
-    rt = RichText()
-    rt.add(formatted, italic=True)
-    return rt
-
-
-def paragraph_has_drawings(paragraph):
-    for run in paragraph.runs:
-        if run._element.xpath('.//w:drawing'):
-            return True
-    return False
-
-
-def paragraph_has_page_break(paragraph):
-    for run in paragraph.runs:
-        for br in run._element.xpath('.//w:br'):
-            br_type = br.get('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}type')
-            if br_type in (None, 'page'):
-                return True
-    return False
-
-
-def paragraph_has_content(paragraph):
-    return bool(paragraph.text.strip()) or paragraph_has_drawings(paragraph)
-
-
-def cleanup_unused_analog_pages(doc_path, analog_count):
-    doc = Document(doc_path)
-    import re
-    paragraphs = doc.paragraphs
-    analog_pattern = re.compile(r'объект-аналог\s*№\s*(\d+)', re.IGNORECASE)
-    last_idx = -1
-    for idx, paragraph in enumerate(paragraphs):
-        match = analog_pattern.search(paragraph.text)
-        if match:
-            try:
-                number = int(match.group(1))
-            except ValueError:
-                continue
-            if number <= analog_count:
-                last_idx = idx
-    start_idx = last_idx + 1 if analog_count else 0
-    removed_any = False
-    i = start_idx
-    while i < len(doc.paragraphs):
-        paragraphs = doc.paragraphs
-        if i >= len(paragraphs):
-            break
-        paragraph = paragraphs[i]
-        if paragraph_has_content(paragraph):
-            i += 1
-            continue
-        block_start = i
-        block_end = i
-        has_break = paragraph_has_page_break(paragraph)
-        while block_end + 1 < len(paragraphs):
-            next_paragraph = paragraphs[block_end + 1]
-            if paragraph_has_content(next_paragraph):
-                break
-            block_end += 1
-            if paragraph_has_page_break(next_paragraph):
-                has_break = True
-        next_index = block_end + 1
-        if has_break and block_start >= start_idx:
-            for pos in range(block_end, block_start - 1, -1):
-                par = doc.paragraphs[pos]
-                parent = par._element.getparent()
-                parent.remove(par._element)
-            removed_any = True
-        else:
-            i = next_index
-            continue
-        # after removal, continue from block_start (same index)
-        i = block_start
-    if removed_any:
-        doc.save(doc_path)
-
 # -----------------------------
 # МОДАЛЬНОЕ ОКНО АВТОРИЗАЦИИ
 # -----------------------------
@@ -300,9 +134,27 @@ with st.sidebar:
     st.markdown(f"**Логин:** {st.session_state.get('user_login', '')}")
     st.markdown(f"**UUID:** {st.session_state.get('uuid7', '')}")
     if st.button("Выйти"):
-        for k in ("auth_ok","user_name","user_login","auth_name","auth_login","uuid7","uuid7_display"):
+        for k in ("auth_ok","user_name","user_login","auth_name","auth_login","uuid7","uuid7_display",
+                  "draft_login","draft_offer","draft_files","draft_signature"):
             st.session_state.pop(k, None)
         st.rerun()
+    if st.session_state.get("user_login") in ADMIN_LOGINS:
+        with st.expander("Замеры рендера (p50/p95)"):
+            entries = read_recent()
+            if entries:
+                st.code(format_summary(summarize(entries)), language=None)
+                cache_rate = format_cache_rate(sum_counters(entries))
+                if cache_rate:
+                    st.caption(cache_rate)
+            else:
+                st.caption("Замеров пока нет.")
+        st.checkbox(
+            "Профилировать рендер (cProfile)",
+            key="profile_render",
+            value=PROFILE_ALWAYS,
+            disabled=PROFILE_ALWAYS,
+            help="Профиль сохраняется рядом с отчётом в generated/",
+        )
 
 # -----------------------------
 # ОСНОВНОЙ ИНТЕРФЕЙС
@@ -313,54 +165,248 @@ if "contractor" not in st.session_state:
     st.session_state["contractor"] = DEFAULT_CONTRACTOR
 
 ensure_analog_state()
+# docxtpl и разбор шаблона — в фоне, пока пользователь заполняет форму
+warm_up_async(TEMPLATE_PATH)
 
-with st.form("auto_appraisal_form", clear_on_submit=False):
-    col1, col2 = st.columns(2)
+# -----------------------------
+# ЧЕРНОВИК
+# -----------------------------
+# Поля и загруженные файлы сохраняются на диск по ходу заполнения
+# (ocenka.drafts: файлы по содержимому, уже сохранённые не пишутся повторно)
+# и после обновления страницы, обрыва связи или перезапуска сервера
+# восстанавливаются по логину. Загрузчику нельзя вернуть файлы программно:
+# восстановленные лежат в session_state["draft_files"] и показываются под
+# загрузчиком вместе с новыми, обработчик отправки берёт и те и другие.
+# Поля внутри st.form попадают в session_state (и в черновик) только при
+# отправке формы; аналоги и загрузки — сразу.
+FORM_FIELDS = (
+    "contract_no", "basis", "valuation_date", "report_date", "otchet_number", "object_type",
+    "car_number", "car_name", "vin_model", "customer", "contractor", "price_no_vat", "price_vat",
+)
+DATE_FIELDS = {"valuation_date", "report_date"}
+
+
+def uploaded_files(key):
+    # файлы из черновика + загруженные в этой сессии
+    return list(st.session_state.get("draft_files", {}).get(key, [])) + list(st.session_state.get(key) or [])
+
+
+def draft_snapshot():
+    # -> (поля, {загрузчик: файлы}) в том виде, в каком они пишутся в черновик
+    form = {}
+    for key in FORM_FIELDS:
+        value = st.session_state.get(key)
+        form[key] = value.isoformat() if isinstance(value, date) else value
+    slots = st.session_state.get("analog_slots", [])
+    fields = {
+        "form": form,
+        "analog_slots": slots,
+        "analog_counter": st.session_state.get("analog_counter", 0),
+        "analogs": {
+            str(slot_id): {
+                "title": st.session_state.get(f"analog_title_{slot_id}"),
+                "source": st.session_state.get(f"analog_source_{slot_id}"),
+            }
+            for slot_id in slots
+        },
+    }
+    keys = [key for key, _label in UPLOADERS] + [f"analog_files_{slot_id}" for slot_id in slots]
+    files = {key: uploaded_files(key) for key in keys}
+    return fields, {key: value for key, value in files.items() if value}
 
-    with col1:
-        contract_no   = st.text_input("Номер договора", key="contract_no")
-        basis         = st.text_input("Основание", key="basis")
-        valuation_date= st.date_input("Дата оценки:", value=date.today(), key="valuation_date")
-        report_date   = st.date_input("Дата составления Отчета об оценке:", value=date.today(), key="report_date")
-        otchet_number = st.text_input("Номер отчета", key="otchet_number")
-        object_type   = st.text_input("Тип оцениваемого объекта", key="object_type")
-        car_number    = st.text_input("Регистрационный номер автомобиля", key="car_number")
 
-    with col2:
-        car_name      = st.text_input("Наим. транспортного средства", key="car_name")
-        vin_model     = st.text_input("VIN", key="vin_model")
-        customer      = st.text_input("Заказчик:", key="customer")
-        contractor    = st.text_input(
-            "Исполнитель:",
-            key="contractor",
-            help="По умолчанию подставляется ООО «Агентство «Бизнес-Актив», измени при необходимости."
-        )
-        price_no_vat  = st.number_input("Стоимость без НДС:", min_value=0.0, step=0.01, format="%.2f", key="price_no_vat")
-        price_vat     = st.number_input("Стоимость с НДС:",  min_value=0.0, step=0.01, format="%.2f", key="price_vat")
+def draft_is_empty(fields, files) -> bool:
+    # даты и исполнитель заполнены всегда — пустую форму не сохраняем
+    if files:
+        return False
+    for key, value in fields["form"].items():
+        if key not in DATE_FIELDS and value not in (None, "", 0.0, DEFAULT_CONTRACTOR):
+            return False
+    return not any(analog["source"] for analog in fields["analogs"].values())
+
+
+def draft_signature(fields, files):
+    return (
+        json.dumps(fields, sort_keys=True, ensure_ascii=False),
+        tuple((key, tuple(getattr(f, "file_id", f.name) for f in value)) for key, value in files.items()),
+    )
+
+
+def autosave_draft():
+    # в конце скрипта и каждого фрагмента; в фон уходят только изменения.
+    # Форму очистили, все загрузки убрали — черновик удаляется, а не остаётся
+    # старым
+    login = st.session_state.get("user_login")
+    if not login or "draft_offer" in st.session_state:
+        return
+    fields, files = draft_snapshot()
+    signature = draft_signature(fields, files)
+    if signature == st.session_state.get("draft_signature"):
+        return
+    st.session_state["draft_signature"] = signature
+    if draft_is_empty(fields, files):
+        clear_draft(login)
+    else:
+        draft_store.save_async(login, fields, files)
+
+
+def clear_draft(login):
+    # файлы черновика, ещё лежащие в форме (и в отправленном задании),
+    # читаем в память до удаления их с диска
+    for files in st.session_state.get("draft_files", {}).values():
+        for draft_file in files:
+            draft_file.detach()
+    draft_store.delete(login)
+
+
+def restore_draft():
+    draft = st.session_state.pop("draft_offer", None)
+    if draft is None:
+        return
+    fields = draft["fields"]
+    for key, value in fields.get("form", {}).items():
+        if key in FORM_FIELDS and value is not None:
+            st.session_state[key] = date.fromisoformat(value) if key in DATE_FIELDS else value
+    slots = fields.get("analog_slots") or []
+    st.session_state["analog_slots"] = slots
+    st.session_state["analog_counter"] = max([fields.get("analog_counter", 0), *slots])
+    for slot_id, analog in fields.get("analogs", {}).items():
+        for part in ("title", "source"):
+            if analog.get(part) is not None:
+                st.session_state[f"analog_{part}_{slot_id}"] = analog[part]
+    st.session_state["draft_files"] = draft["files"]
+
+
+def discard_draft():
+    st.session_state.pop("draft_offer", None)
+    draft_store.delete(st.session_state.get("user_login"))
+
+
+def drop_draft_files(key):
+    st.session_state.get("draft_files", {}).pop(key, None)
+
+
+# черновик ищем один раз на вход пользователя
+if st.session_state.get("draft_login") != st.session_state.get("user_login"):
+    st.session_state["draft_login"] = st.session_state.get("user_login")
+    found_draft = draft_store.load(st.session_state["draft_login"])
+    if found_draft is not None:
+        st.session_state["draft_offer"] = found_draft
+
+draft_offer = st.session_state.get("draft_offer")
+if draft_offer is not None:
+    draft_files_count = sum(len(files) for files in draft_offer["files"].values())
+    st.info(
+        f"Найден черновик формы от {draft_offer['updated_at'][:16].replace('T', ' ')} UTC: "
+        f"файлов {draft_files_count} ({draft_offer['bytes'] / 1024 / 1024:.1f} МБ). "
+        "Пока вы не выберете, изменения в черновик не записываются."
+    )
+    restore_col, discard_col = st.columns(2)
+    with restore_col:
+        st.button("Восстановить черновик", type="primary", on_click=restore_draft)
+    with discard_col:
+        st.button("Удалить черновик", on_click=discard_draft)
+
+# -----------------------------
+# ВЛОЖЕНИЯ И ПРЕВЬЮ
+# -----------------------------
+# Загрузчики вне формы, в своём фрагменте: внутри st.form загруженные файлы
+# видны скрипту только после отправки, а здесь под каждым загрузчиком сразу
+# показываются миниатюры (ocenka.thumbnails — строятся один раз на
+# содержимое, в браузер уходят килобайты). Загрузка перезапускает только
+# этот блок; обработчик отправки берёт файлы из session_state по ключам.
+# Миниатюры скрипт не ждёт: пока какие-то строятся, сетка превью — отдельный
+# фрагмент с таймером, готовые появляются без действий пользователя.
+UPLOADERS = (
+    ("object_photos", "Фотографии объекта оценки"),
+    ("appendix_1", "Приложение 1"),
+    ("appendix_2", "Приложение 2"),
+    ("rights_docs", "Подтверждение права оценщика и исполнителя заниматься оценочной деятельностью"),
+)
+PREVIEW_COLUMNS = 6
+# как часто опрашивать неготовые миниатюры, секунд
+PREVIEW_POLL_S = 0.5
+
+
+def preview_grid(files, polling):
+    previews = thumbnail_cache.previews(files)
+    if polling and not thumbnail_cache.pending(files):
+        # всё готово — полный перезапуск, чтобы остановить опрос
+        st.rerun()
+    cols = st.columns(PREVIEW_COLUMNS)
+    for idx, (name, thumb) in enumerate(previews):
+        with cols[idx % PREVIEW_COLUMNS]:
+            if thumb:
+                st.image(thumb, caption=name, width="stretch")
+            elif thumb is None:
+                st.caption(f"{name}: превью готовится…")
+            else:
+                st.caption(name)
+
+
+def show_previews(files):
+    if not files:
+        return
+    thumbnail_cache.request(files)
+    polling = thumbnail_cache.pending(files)
+    st.fragment(preview_grid, run_every=PREVIEW_POLL_S if polling else None)(files, polling)
+
 
-    object_photos_raw = st.file_uploader("Фотографии объекта оценки", accept_multiple_files=True, key="object_photos")
-    appendix_1_files_raw = st.file_uploader("Приложение 1", accept_multiple_files=True, key="appendix_1")
-    appendix_2_files_raw = st.file_uploader("Приложение 2", accept_multiple_files=True, key="appendix_2")
-    rights_files_raw = st.file_uploader("Подтверждение права оценщика и исполнителя заниматься оценочной деятельностью", accept_multiple_files=True, key="rights_docs")
+def uploader_with_previews(label, key, **kwargs):
+    st.file_uploader(label, accept_multiple_files=True, key=key, **kwargs)
+    restored = st.session_state.get("draft_files", {}).get(key)
+    if restored:
+        caption_col, drop_col = st.columns([6, 1])
+        with caption_col:
+            st.caption(f"Из черновика: {len(restored)} файл(ов), загружать повторно не нужно.")
+        with drop_col:
+            st.button("Убрать", key=f"drop_draft_{key}", on_click=drop_draft_files, kwargs={"key": key},
+                      help="Убрать файлы черновика из этого поля")
+    show_previews(uploaded_files(key))
 
+
+@st.fragment
+def attachments_editor():
+    # все недостающие миниатюры сразу в пул одним вызовом
+    thumbnail_cache.request([f for key, _label in UPLOADERS for f in uploaded_files(key)])
+    for key, label in UPLOADERS:
+        uploader_with_previews(label, key)
+    autosave_draft()
+
+
+attachments_editor()
+
+# -----------------------------
+# РЕДАКТОР ОБЪЕКТОВ-АНАЛОГОВ
+# -----------------------------
+# Отдельный фрагмент вне формы: добавление/удаление аналога, ввод и загрузка
+# фото перезапускают только этот блок, а не весь main.py (сайдбар, форму,
+# загрузчики основного раздела). Значения лежат в session_state по ключам
+# analog_title_/analog_files_/analog_source_{slot_id}, обработчик отправки
+# формы читает их оттуда.
+@st.fragment
+def analog_editor():
     with st.expander("Объекты-аналоги", expanded=False):
         slots = st.session_state.get("analog_slots", [])
-        st.caption("Добавляйте до 10 объектов-аналогов. Описания и фотографии попадут в шаблон отчета.")
+        thumbnail_cache.request([f for slot_id in slots for f in uploaded_files(f"analog_files_{slot_id}")])
+        st.caption(
+            "Добавляйте столько объектов-аналогов, сколько нужно. Описания и фотографии "
+            "попадут в шаблон отчета при нажатии «Сформировать и скачать DOCX»."
+        )
         if not slots:
             st.info("Нажмите «Добавить объект-аналог», чтобы создать первый блок.")
         for display_index, slot_id in enumerate(slots, start=1):
             cols = st.columns([6, 1])
             title_key = f"analog_title_{slot_id}"
-            default_value = st.session_state.get(title_key, default_analog_heading(display_index))
+            st.session_state.setdefault(title_key, default_analog_heading(display_index))
             with cols[0]:
                 st.text_input(
                     f"Название / описание для аналога №{display_index}",
-                    value=default_value,
                     key=title_key,
-                    help="Это значение подставится в {{ object_analogN }}.",
+                    help="Это значение подставится в {{ analog.title }}.",
                 )
             with cols[1]:
-                st.form_submit_button(
+                st.button(
                     "Удалить",
                     type="secondary",
                     key=f"remove_analog_{slot_id}",
@@ -368,104 +414,114 @@ with st.form("auto_appraisal_form", clear_on_submit=False):
                     kwargs={"slot_id": slot_id},
                     help="Удалить этот объект-аналог",
                 )
-            st.file_uploader(
+            uploader_with_previews(
                 f"Фотографии для аналога №{display_index}",
-                accept_multiple_files=True,
-                key=f"analog_files_{slot_id}",
-                help="Файлы будут размещены в {{ object_analogN_photo }}.",
+                f"analog_files_{slot_id}",
+                help="Файлы будут размещены в {{ analog.photos }}.",
             )
-            source_key = f"analog_source_{slot_id}"
-            default_source = st.session_state.get(source_key, "")
             st.text_input(
                 f"Источник для аналога №{display_index}",
-                value=default_source,
-                key=source_key,
-                help="Текст подставится в {{ a_sourceN }} и будет показан курсивом после фотографий.",
+                key=f"analog_source_{slot_id}",
+                help="Текст подставится в {{ analog.source }} и будет показан курсивом после фотографий.",
                 placeholder="https://...",
             )
             if display_index != len(slots):
                 st.divider()
-        st.form_submit_button(
+        st.button(
             "➕ Добавить объект-аналог",
             key="add_analog_button",
             type="secondary",
             on_click=add_analog_slot,
-            disabled=len(slots) >= MAX_ANALOGS,
             help="Добавить ещё один блок загрузки",
         )
+    autosave_draft()
+
+
+analog_editor()
+
+with st.form("auto_appraisal_form", clear_on_submit=False):
+    col1, col2 = st.columns(2)
+
+    with col1:
+        contract_no   = st.text_input("Номер договора", key="contract_no")
+        basis         = st.text_input("Основание", key="basis")
+        valuation_date= st.date_input("Дата оценки:", value="today", key="valuation_date")
+        report_date   = st.date_input("Дата составления Отчета об оценке:", value="today", key="report_date")
+        otchet_number = st.text_input("Номер отчета", key="otchet_number")
+        object_type   = st.text_input("Тип оцениваемого объекта", key="object_type")
+        car_number    = st.text_input("Регистрационный номер автомобиля", key="car_number")
+
+    with col2:
+        car_name      = st.text_input("Наим. транспортного средства", key="car_name")
+        vin_model     = st.text_input("VIN", key="vin_model")
+        customer      = st.text_input("Заказчик:", key="customer")
+        contractor    = st.text_input(
+            "Исполнитель:",
+            key="contractor",
+            help="По умолчанию подставляется ООО «Агентство «Бизнес-Актив», измени при необходимости."
+        )
+        price_no_vat  = st.number_input("Стоимость без НДС:", min_value=0.0, step=0.01, format="%.2f", key="price_no_vat")
+        price_vat     = st.number_input("Стоимость с НДС:",  min_value=0.0, step=0.01, format="%.2f", key="price_vat")
+
 
     submitted = st.form_submit_button("Сформировать и скачать DOCX", type="primary")
 
 
 
 if submitted:
+    trace = RenderTrace(
+        source="ui",
+        user_uuid=st.session_state.get("uuid7"),
+        user_login=st.session_state.get("user_login"),
+        contract=contract_no,
+    )
+    ingest_stage = trace.stage("ingest")
+    object_photos_raw = uploaded_files("object_photos")
+    appendix_1_files_raw = uploaded_files("appendix_1")
+    appendix_2_files_raw = uploaded_files("appendix_2")
+    rights_files_raw = uploaded_files("rights_docs")
     appendix_1_files = []
     appendix_1_failures = []
     for uploaded_file in (appendix_1_files_raw or []):
         try:
-            payload = uploaded_file.getvalue()
-            if not payload:
-                raise ValueError('empty payload')
+            item = ingest_upload(uploaded_file, 'без названия')
         except Exception:
             appendix_1_failures.append(uploaded_file.name or 'без названия')
         else:
-            appendix_1_files.append({
-                'name': uploaded_file.name or 'без названия',
-                'data': payload,
-                'size': len(payload),
-            })
+            appendix_1_files.append(item)
 
     appendix_2_files = []
     appendix_2_failures = []
     for uploaded_file in (appendix_2_files_raw or []):
         try:
-            payload = uploaded_file.getvalue()
-            if not payload:
-                raise ValueError('empty payload')
+            item = ingest_upload(uploaded_file, 'без названия')
         except Exception:
             appendix_2_failures.append(uploaded_file.name or 'без названия')
         else:
-            appendix_2_files.append({
-                'name': uploaded_file.name or 'без названия',
-                'data': payload,
-                'size': len(payload),
-            })
+            appendix_2_files.append(item)
 
     rights_files = []
     rights_failures = []
     for uploaded_file in (rights_files_raw or []):
         try:
-            payload = uploaded_file.getvalue()
-            if not payload:
-                raise ValueError('empty payload')
+            item = ingest_upload(uploaded_file, 'без названия')
         except Exception:
             rights_failures.append(uploaded_file.name or 'без названия')
         else:
-            rights_files.append({
-                'name': uploaded_file.name or 'без названия',
-                'data': payload,
-                'size': len(payload),
-            })
+            rights_files.append(item)
 
     object_photos = []
     object_photo_failures = []
     for uploaded_file in (object_photos_raw or []):
         try:
-            payload = uploaded_file.getvalue()
-            if not payload:
-                raise ValueError('empty payload')
+            item = ingest_upload(uploaded_file, 'без названия')
         except Exception:
             object_photo_failures.append(uploaded_file.name or 'без названия')
         else:
-            object_photos.append({
-                'name': uploaded_file.name or 'без названия',
-                'data': payload,
-                'size': len(payload),
-            })
+            object_photos.append(item)
 
     analog_slots_snapshot = st.session_state.get('analog_slots', [])
     analog_results = []
-    analog_failures = []
     for display_index, slot_id in enumerate(analog_slots_snapshot, start=1):
         title_key = f"analog_title_{slot_id}"
         raw_title = (st.session_state.get(title_key) or '').strip()
@@ -474,24 +530,16 @@ if submitted:
         source_key = f"analog_source_{slot_id}"
         raw_source = (st.session_state.get(source_key) or '').strip()
         files_key = f"analog_files_{slot_id}"
-        uploaded_files = st.session_state.get(files_key) or []
         slot_files = []
         slot_failures = []
-        for uploaded_file in uploaded_files:
+        for uploaded_file in uploaded_files(files_key):
             try:
-                payload = uploaded_file.getvalue()
-                if not payload:
-                    raise ValueError('empty payload')
+                item = ingest_upload(uploaded_file, ANALOG_EMPTY_TITLE)
             except Exception:
                 fail_name = uploaded_file.name or ANALOG_EMPTY_TITLE
                 slot_failures.append(fail_name)
-                analog_failures.append(f"аналог №{display_index}: {fail_name}")
             else:
-                slot_files.append({
-                    'name': uploaded_file.name or ANALOG_EMPTY_TITLE,
-                    'data': payload,
-                    'size': len(payload),
-                })
+                slot_files.append(item)
         analog_results.append({
             'index': display_index,
             'slot_id': slot_id,
@@ -501,17 +549,27 @@ if submitted:
             'failures': slot_failures,
         })
 
+    ingest_stage.stop(bytes_in=sum(
+        item['size']
+        for files in (appendix_1_files, appendix_2_files, rights_files, object_photos)
+        for item in files
+    ) + sum(item['size'] for analog in analog_results for item in analog['files']))
+
+    report = {
+        'object_photos': object_photos,
+        'object_photo_failures': object_photo_failures,
+        'appendix_1_files': appendix_1_files,
+        'appendix_1_failures': appendix_1_failures,
+        'appendix_2_files': appendix_2_files,
+        'appendix_2_failures': appendix_2_failures,
+        'rights_files': rights_files,
+        'rights_failures': rights_failures,
+        'analogs': analog_results,
+    }
     appendix_1_names = [item['name'] for item in appendix_1_files]
     appendix_2_names = [item['name'] for item in appendix_2_files]
     rights_names = [item['name'] for item in rights_files]
     object_photo_names = [item['name'] for item in object_photos]
-    failed_uploads = (
-        appendix_1_failures
-        + appendix_2_failures
-        + rights_failures
-        + object_photo_failures
-        + analog_failures
-    )
 
     analog_record_entries = [
         {
@@ -555,8 +613,16 @@ if submitted:
     with st.expander("Проверить данные перед подстановкой в шаблон"):
         st.json(record)
 
+    report['record'] = record
+    # у каждой отправки свой id отчёта в архиве — повторная отправка
+    # не перезаписывает прежний файл
+    report_id = new_report_id()
+    out_name = report_file_name(record)
+    # запись, вложения и имя файла — в локальную базу; пишет фоновый поток
+    appraisal_store.save_async(record, out_name, attachments_from_report(report), report_id)
+
     # ---- РЕНДЕР ДОКУМЕНТА ИЗ ШАБЛОНА ----
-    tpl_path = TEMPLATES_DIR / TEMPLATE_NAME
+    tpl_path = TEMPLATE_PATH
     if not tpl_path.exists():
         st.error(
             f"Не найден шаблон: {tpl_path}\n"
@@ -564,153 +630,73 @@ if submitted:
             f"В следующем шаге добавим файл."
         )
     else:
-        # Импортируем тут, чтобы приложение работало даже без docxtpl до клика
+        # рендер идёт в фоновом пуле: скрипт сразу возвращается, статус
+        # задания показывает блок ниже формы; наличие docxtpl проверяет
+        # ocenka.deps при старте приложения
+        previous_job = st.session_state.pop("render_job_id", None)
+        if previous_job:
+            render_queue.forget(previous_job)
         try:
-            from docxtpl import DocxTemplate
-        except Exception as e:
-            st.error(
-                "Не удалось импортировать docxtpl. "
-                "Убедись, что в requirements.txt есть строка: docxtpl"
+            job = render_queue.submit(
+                report,
+                report_id,
+                out_name,
+                tpl_path,
+                trace,
+                profile=PROFILE_ALWAYS or st.session_state.get("profile_render", False),
             )
-            st.stop()
-
-        # МАППИНГ ПОЛЕЙ -> МЕТКИ {{ ... }} В ШАБЛОНЕ
-        # (использую именно те ключи, которые ты перечислил)
-        doc = DocxTemplate(str(tpl_path))
-
-        appendix_1_entries = build_appendix_entries(doc, appendix_1_files, appendix_1_failures)
-        appendix_2_entries = build_appendix_entries(doc, appendix_2_files, appendix_2_failures)
-        rights_entries = build_appendix_entries(doc, rights_files, rights_failures)
-
-        context = {
-            # как ты указал: Основание -> {{ contract_number }} (да, дублируется)
-            "contract_number": contract_no,               # Номер контракта / и по твоей строке "Основание"
-            "date_ocenka": safe_str_date(valuation_date),
-            "date_otcheta": safe_str_date(report_date),
-            "customer_name": customer,
-
-            # нижний блок:
-            "contractor": contractor,
-            "otchet_number": otchet_number,
-            "object_type": object_type,
-            "car_name": car_name,
-            "vin_model": vin_model,
-            "cost_of_assessment": f"{price_no_vat:,.2f}".replace(",", " "),
-            "cost_of_assessment_NDS": f"{price_vat:,.2f}".replace(",", " "),
-        }
-        context["appendix_1_summary"] = summarize_attachments(appendix_1_files, appendix_1_failures)
-        context["appendix_2_summary"] = summarize_attachments(appendix_2_files, appendix_2_failures)
-        context["rights_summary"] = summarize_attachments(rights_files, rights_failures)
-        context["appendix_1_entries"] = appendix_1_entries
-        context["appendix_2_entries"] = appendix_2_entries
-        context["rights_entries"] = rights_entries
-        context["object_ocenki"] = build_photos_subdoc(
-            doc,
-            object_photos,
-            empty_message="Фотографии объекта не загружены."
-        )
-        for idx in range(1, MAX_ANALOGS + 1):
-            if idx <= len(analog_results):
-                analog_item = analog_results[idx - 1]
-                context[f"object_analog{idx}"] = analog_item['title']
-                if analog_item['files'] and analog_item['source']:
-                    context[f"a_source{idx}"] = format_analog_source(analog_item['source'])
-                else:
-                    context[f"a_source{idx}"] = ""
-                empty_msg = "Фотографии объекта-аналога не загружены." if not analog_item['files'] else ''
-                context[f"object_analog{idx}_photo"] = build_photos_subdoc(
-                    doc,
-                    analog_item['files'],
-                    empty_message=empty_msg
-                )
-            else:
-                context[f"object_analog{idx}"] = ''
-                context[f"a_source{idx}"] = ""
-                context[f"object_analog{idx}_photo"] = build_photos_subdoc(
-                    doc,
-                    [],
-                    empty_message=''
-                )
-
-        doc.render(context)
-
-        out_name = f"Отчёт_{contract_no or 'без_номера'}_{st.session_state.get('uuid7')}.docx"
-
-        out_path = GENERATED_DIR / out_name
-
-        doc.save(str(out_path))
-
-        cleanup_unused_analog_pages(out_path, len(analog_results))
-
-
-
-
-        with open(out_path, "rb") as f:
-
-            data = f.read()
-
-
-
-        st.download_button(
-
-            label="⬇️ Скачать сформированный DOCX",
-
-            data=data,
+        except QueueFull:
+            st.error("Сервер занят: слишком много отчётов в очереди. Попробуйте через минуту.")
+        else:
+            st.session_state["render_job_id"] = job.id
+            # отчёт отправлен — черновик больше не нужен; пока форму не
+            # поменяют, заново он не сохраняется
+            clear_draft(st.session_state.get("user_login"))
+            st.session_state["draft_signature"] = draft_signature(*draft_snapshot())
 
-            file_name=out_name,
 
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+# -----------------------------
+# СТАТУС ФОНОВОГО РЕНДЕРА
+# -----------------------------
+def render_job_panel(polling):
+    job = render_queue.get(st.session_state.get("render_job_id"))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress(), text=job.describe())
+        return
+    if polling:
+        # задание завершилось — полный перезапуск, чтобы остановить опрос
+        st.rerun()
 
-            type="primary"
+    if job.status == "error":
+        st.error(f"Не удалось сформировать отчёт: {job.error}")
+        return
 
+    st.download_button(
+        label="⬇️ Скачать сформированный DOCX",
+        data=job.data,
+        file_name=job.out_name,
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        type="primary",
+        key=f"download_{job.id}",
+    )
+    if job.failures:
+        st.warning(
+            "Не все файлы приложений были загружены: "
+            + ', '.join(job.failures)
+            + ". Проверьте соединение и попробуйте загрузить их повторно."
         )
-
-        if failed_uploads:
-
-            st.warning(
-
-                "Не все файлы приложений были загружены: "
-
-                + ', '.join(failed_uploads)
-
-                + ". Проверьте соединение и попробуйте загрузить их повторно."
-
-            )
+    st.info(f"Файл также сохранён в архиве: {job.out_path} (id {job.report_id})")
+    if job.image_stats.count:
+        st.caption(job.image_stats.summary())
+    if job.profile_path is not None:
+        with st.expander(f"Профиль рендера: {job.profile_path.name}"):
+            st.code(job.profile_top, language=None)
 
 
+current_job = render_queue.get(st.session_state.get("render_job_id"))
+job_active = current_job is not None and current_job.active
+st.fragment(render_job_panel, run_every=1.0 if job_active else None)(job_active)
 
-        st.info(f"Файл также сохранён локально: {out_path}")
-
-        # ----------- БД (оставлено закомментированным) -----------
-        # import mysql.connector
-        # try:
-        #     conn = mysql.connector.connect(
-        #         host="localhost",
-        #         user="user",
-        #         password="password",
-        #         database="auto_appraisal_db",
-        #     )
-        #     cur = conn.cursor()
-        #     cur.execute(
-        #         """
-        #         INSERT INTO appraisals (
-        #             user_uuid, user_name, user_login,
-        #             contract_no, basis, valuation_date, report_date,
-        #             customer, contractor, price_vat, price_no_vat,
-        #             otchet_number, object_type, car_name, vin_model, file_name
-        #         ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        #         """,
-        #         (
-        #             record["user_uuid"], record["user_name"], record["user_login"],
-        #             contract_no, basis, safe_str_date(valuation_date), safe_str_date(report_date),
-        #             customer, contractor, price_vat, price_no_vat,
-        #             otchet_number, object_type, car_name, vin_model, out_name
-        #         ),
-        #     )
-        #     conn.commit()
-        #     cur.close()
-        #     conn.close()
-        #     st.success("Запись сохранена в базу данных MySQL.")
-        # except Exception as e:
-        #     st.error(f"Ошибка сохранения в MySQL: {e}")
-        # ----------------------------------------------------------
+autosave_draft()
@@ -0,0 +1 @@
+# Общая логика формирования отчёта об оценке (используется из main.py).
@@ -0,0 +1,242 @@
+# -----------------------------
+# АРХИВ ГОТОВЫХ ОТЧЁТОВ
+# -----------------------------
+# Пример: python -m ocenka.archive --contract 12/34   (поиск)
+#         python -m ocenka.archive --sweep            (очистка по квотам)
+#
+# Каждый рендер получает собственный идентификатор отчёта — упорядоченный
+# по времени, как UUIDv7: повторная отправка в той же сессии и разные
+# пользователи больше не перезаписывают файлы друг друга.
+#
+# Раскладка в OCENKA_ARCHIVE_DIR (по умолчанию generated/):
+#   objects/ab/cd/<sha256>.docx — содержимое; одинаковые по байтам отчёты
+#                                 хранятся один раз
+#   archive.sqlite3             — индекс: id отчёта -> sha256, имя для
+#                                 скачивания, договор, user_uuid, время
+#
+# Очистка идёт в фоне после сохранения (не чаще раза в
+# OCENKA_ARCHIVE_SWEEP_S секунд): удаляются отчёты старше
+# OCENKA_ARCHIVE_DAYS дней, затем самые старые, пока архив больше
+# OCENKA_ARCHIVE_MB. Файл удаляется, когда на него не ссылается ни один отчёт.
+import argparse
+import hashlib
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from ocenka.output import write_atomic
+from ocenka.store import connect
+
+ARCHIVE_DIR = Path(
+    os.environ.get("OCENKA_ARCHIVE_DIR") or Path(__file__).resolve().parent.parent / "generated"
+)
+# 0 — без ограничения
+ARCHIVE_DAYS = float(os.environ.get("OCENKA_ARCHIVE_DAYS", "180"))
+ARCHIVE_MB = float(os.environ.get("OCENKA_ARCHIVE_MB", "5120"))
+SWEEP_INTERVAL = float(os.environ.get("OCENKA_ARCHIVE_SWEEP_S", "600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id          TEXT PRIMARY KEY,
+    sha256      TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    contract_no TEXT,
+    user_uuid   TEXT,
+    created_at  TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_reports_contract ON reports(contract_no, id);
+CREATE INDEX IF NOT EXISTS ix_reports_sha ON reports(sha256);
+"""
+
+_id_lock = threading.Lock()
+_last_id_ms = 0
+_id_seq = 0
+
+
+def new_report_id() -> str:
+    # 48 бит — миллисекунды, 16 бит — счётчик внутри миллисекунды, 64 бита
+    # случайные: строки id сортируются в порядке создания
+    global _last_id_ms, _id_seq
+    with _id_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms <= _last_id_ms:
+            _id_seq += 1
+            if _id_seq > 0xFFFF:
+                _last_id_ms += 1
+                _id_seq = 0
+            ms = _last_id_ms
+        else:
+            _id_seq = 0
+        _last_id_ms = ms
+        seq = _id_seq
+    return f"{ms:012x}{seq:04x}{secrets.randbits(64):016x}"
+
+
+class ReportArchive:
+    def __init__(self, root=None):
+        self.root = Path(root or ARCHIVE_DIR)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocenka-archive")
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.root / "archive.sqlite3")
+            conn.executescript(SCHEMA)
+        return conn
+
+    def object_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256[2:4] / f"{sha256}.docx"
+
+    # ---- запись ----
+    def put_async(self, report_id, data: bytes, name, contract_no=None, user_uuid=None):
+        # путь известен сразу, запись файла и индекса — в фоновом потоке;
+        # -> (путь к файлу, Future)
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.object_path(sha256)
+        future = self._executor.submit(
+            self._store, report_id, sha256, path, data, name, contract_no, user_uuid
+        )
+        return path, future
+
+    def put(self, report_id, data: bytes, name, contract_no=None, user_uuid=None) -> Path:
+        path, future = self.put_async(report_id, data, name, contract_no, user_uuid)
+        future.result()
+        return path
+
+    def _store(self, report_id, sha256, path, data, name, contract_no, user_uuid):
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(path, data)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (id, sha256, size, name, contract_no, user_uuid, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (report_id, sha256, len(data), name, contract_no or None, user_uuid,
+                 datetime.now(timezone.utc).isoformat(timespec="seconds")),
+            )
+        if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep()
+        return path
+
+    # ---- чтение ----
+    def _entry(self, row):
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["path"] = self.object_path(entry["sha256"])
+        return entry
+
+    def get(self, report_id):
+        row = self._conn().execute(
+            "SELECT id, sha256, size, name, contract_no, user_uuid, created_at FROM reports WHERE id = ?",
+            (report_id,),
+        ).fetchone()
+        return self._entry(row)
+
+    def find_by_contract(self, contract_no, limit=100):
+        # новые отчёты первыми
+        rows = self._conn().execute(
+            "SELECT id, sha256, size, name, contract_no, user_uuid, created_at FROM reports "
+            "WHERE contract_no = ? ORDER BY id DESC LIMIT ?",
+            (contract_no, limit),
+        ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def read(self, report_id) -> bytes:
+        entry = self.get(report_id)
+        if entry is None:
+            raise KeyError(report_id)
+        return entry["path"].read_bytes()
+
+    # ---- очистка ----
+    def sweep(self):
+        return self._executor.submit(self._sweep).result()
+
+    def _sweep(self):
+        # -> (удалено отчётов, удалено файлов)
+        self._last_sweep = time.monotonic()
+        conn = self._conn()
+        removed = []
+        with conn:
+            if ARCHIVE_DAYS > 0:
+                border = f"{int((time.time() - ARCHIVE_DAYS * 86400) * 1000):012x}"
+                removed += conn.execute("SELECT id, sha256 FROM reports WHERE id < ?", (border,)).fetchall()
+                conn.execute("DELETE FROM reports WHERE id < ?", (border,))
+            if ARCHIVE_MB > 0:
+                limit = ARCHIVE_MB * 1024 * 1024
+                (total,) = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM reports)"
+                ).fetchone()
+                if total > limit:
+                    # самые старые первыми, пока не уложимся в квоту
+                    for report_id, sha256, size in conn.execute(
+                        "SELECT id, sha256, size FROM reports ORDER BY id"
+                    ).fetchall():
+                        if total <= limit:
+                            break
+                        conn.execute("DELETE FROM reports WHERE id = ?", (report_id,))
+                        removed.append((report_id, sha256))
+                        still_used = conn.execute(
+                            "SELECT 1 FROM reports WHERE sha256 = ? LIMIT 1", (sha256,)
+                        ).fetchone()
+                        if not still_used:
+                            total -= size
+        files = 0
+        for sha256 in {sha256 for _report_id, sha256 in removed}:
+            if conn.execute("SELECT 1 FROM reports WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+                continue
+            try:
+                self.object_path(sha256).unlink()
+                files += 1
+            except FileNotFoundError:
+                pass
+        return len(removed), files
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        reports, = conn.execute("SELECT COUNT(*) FROM reports").fetchone()
+        objects, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM reports)"
+        ).fetchone()
+        return {"reports": reports, "objects": objects, "bytes": size}
+
+
+report_archive = ReportArchive()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Архив сформированных отчётов.")
+    parser.add_argument("--id", help="показать отчёт по идентификатору")
+    parser.add_argument("--contract", help="отчёты по номеру договора")
+    parser.add_argument("--sweep", action="store_true", help="удалить отчёты сверх сроков и квоты")
+    parser.add_argument("--dir", help="каталог архива (по умолчанию OCENKA_ARCHIVE_DIR)")
+    args = parser.parse_args(argv)
+
+    archive = ReportArchive(args.dir) if args.dir else report_archive
+    if args.sweep:
+        reports, files = archive.sweep()
+        print(f"Удалено отчётов: {reports}, файлов: {files}")
+    entries = []
+    if args.id:
+        entry = archive.get(args.id)
+        entries = [entry] if entry else []
+    elif args.contract:
+        entries = archive.find_by_contract(args.contract)
+    for entry in entries:
+        print(f"{entry['id']}  {entry['created_at']}  {entry['size'] / 1024:>8.0f} КБ  {entry['name']}  {entry['path']}")
+    stats = archive.stats()
+    print(f"В архиве: отчётов {stats['reports']}, файлов {stats['objects']}, {stats['bytes'] / 1024 / 1024:.1f} МБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# -----------------------------
+# ПАКЕТНАЯ ГЕНЕРАЦИЯ ОТЧЁТОВ БЕЗ ИНТЕРФЕЙСА
+# -----------------------------
+# Пример: python -m ocenka.cli records.jsonl --images ./photos --out ./generated
+#
+# records.jsonl — по одной записи в строке, в том же виде, что показывается
+# в форме (st.json(record)); имена файлов из записи ищутся в каталоге --images.
+# Записи рендерятся параллельно в пуле процессов, в конце — сводка ошибок.
+import argparse
+import json
+import os
+import sys
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from ocenka import images
+from ocenka.metrics import RenderTrace
+from ocenka.output import write_atomic
+from ocenka.uploads import PathSource
+from ocenka.render import (
+    TEMPLATE_PATH,
+    prepare_images,
+    render_document,
+    report_failures,
+    report_file_name,
+    report_from_record,
+    serialize_document,
+)
+
+
+class DirectoryFiles(Mapping):
+    # «имя файла -> байты» поверх каталога; файлы читаются по требованию
+    def __init__(self, directory):
+        self.directory = Path(directory).resolve()
+
+    def _path(self, name) -> Path:
+        path = (self.directory / name).resolve()
+        if self.directory not in path.parents:
+            raise KeyError(name)
+        return path
+
+    def source(self, name):
+        try:
+            return PathSource(self._path(name))
+        except OSError:
+            raise KeyError(name) from None
+
+    def __getitem__(self, name):
+        try:
+            return self._path(name).read_bytes()
+        except OSError:
+            raise KeyError(name) from None
+
+    def __iter__(self):
+        for path in self.directory.rglob("*"):
+            if path.is_file():
+                yield str(path.relative_to(self.directory))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _init_worker():
+    # параллелизм — на уровне записей, внутри процесса картинки идут по одной
+    images.IMAGE_WORKERS = 1
+
+
+def render_record(line_no, record, images_dir, out_path, template_path):
+    started = time.perf_counter()
+    result = {'line': line_no, 'contract': record.get("Номер договора"), 'path': str(out_path)}
+    trace = RenderTrace(source="cli", user_uuid=record.get("user_uuid"), contract=record.get("Номер договора"))
+    try:
+        with trace.stage("ingest"):
+            report = report_from_record(record, DirectoryFiles(images_dir))
+        prepare_images(report, trace=trace)
+        data = serialize_document(render_document(report, template_path, trace), trace)
+        with trace.stage("persist", bytes_in=len(data)):
+            write_atomic(out_path, data)
+    except Exception as exc:
+        result['error'] = f"{exc.__class__.__name__}: {exc}"
+        trace.write(error=result['error'])
+    else:
+        result['size'] = len(data)
+        result['failures'] = report_failures(report)
+        trace.write()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def read_records(path):
+    records = []
+    errors = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("ожидался JSON-объект")
+            except ValueError as exc:
+                errors.append({'line': line_no, 'contract': None, 'error': f"некорректная строка: {exc}"})
+                continue
+            records.append((line_no, record))
+    return records, errors
+
+
+def assign_output_paths(records, out_dir: Path):
+    # одинаковые договор+uuid в одном пакете не должны затирать друг друга
+    used = set()
+    paths = []
+    for line_no, record in records:
+        name = report_file_name(record)
+        if name in used:
+            stem, suffix = os.path.splitext(name)
+            name = f"{stem}_{line_no}{suffix}"
+        used.add(name)
+        paths.append(out_dir / name)
+    return paths
+
+
+def print_progress(done, total, errors, started, stream=sys.stderr):
+    width = 30
+    filled = int(width * done / total) if total else width
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    stream.write(
+        f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total} "
+        f"ошибок: {errors}  {rate:.2f} отч/с"
+    )
+    stream.flush()
+
+
+def print_summary(results, stream=sys.stdout):
+    rendered = [r for r in results if 'error' not in r]
+    failed = [r for r in results if 'error' in r]
+    partial = [r for r in rendered if r.get('failures')]
+    stream.write(f"Готово: {len(rendered)}, с ошибками: {len(failed)}, с пропущенными файлами: {len(partial)}\n")
+    for r in sorted(failed, key=lambda r: r['line']):
+        stream.write(f"  строка {r['line']} (договор {r['contract'] or '—'}): {r['error']}\n")
+    for r in sorted(partial, key=lambda r: r['line']):
+        stream.write(f"  строка {r['line']} (договор {r['contract'] or '—'}): не вставлены: {', '.join(r['failures'])}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная генерация отчётов об оценке из JSONL.")
+    parser.add_argument("records", help="JSONL-файл с записями (одна запись в строке)")
+    parser.add_argument("--images", required=True, help="каталог с файлами, на которые ссылаются записи")
+    parser.add_argument("--out", default=str(Path(__file__).resolve().parent.parent / "generated"),
+                        help="каталог для готовых DOCX")
+    parser.add_argument("--template", default=str(TEMPLATE_PATH), help="путь к шаблону DOCX")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов")
+    args = parser.parse_args(argv)
+
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    records, results = read_records(args.records)
+    paths = assign_output_paths(records, out_dir)
+
+    total = len(records)
+    started = time.perf_counter()
+    errors = len(results)
+    done = 0
+    print_progress(done, total, errors, started)
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(render_record, line_no, record, args.images, path, args.template): (line_no, record)
+            for (line_no, record), path in zip(records, paths)
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as exc:
+                # упал сам процесс-воркер (например, нехватка памяти)
+                line_no, record = futures[future]
+                result = {'line': line_no, 'contract': record.get("Номер договора"),
+                          'error': f"{exc.__class__.__name__}: {exc}"}
+            results.append(result)
+            done += 1
+            if 'error' in result:
+                errors += 1
+            print_progress(done, total, errors, started)
+    sys.stderr.write("\n")
+    print_summary(results)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# -----------------------------
+# ПРОВЕРКА ЗАВИСИМОСТЕЙ БЕЗ pip
+# -----------------------------
+# Приложение больше не ставит пакеты само: установка —
+# `pip install -r requirements.txt` при развёртывании. При старте только
+# сверяем установленные версии с requirements.txt через importlib.metadata,
+# без подпроцессов и сети; результат кешируется на процесс.
+import functools
+import os
+import sys
+from importlib import metadata
+
+
+def _parse_line(line: str):
+    line = line.split("#", 1)[0].strip()
+    if not line or line.startswith("-"):
+        return None
+    try:
+        from packaging.requirements import Requirement
+    except ImportError:
+        # packaging ставится вместе со streamlit; без него проверяем только наличие
+        name = line
+        for sep in ("==", ">=", "<=", "~=", "!=", ">", "<", "[", ";", " "):
+            name = name.split(sep, 1)[0]
+        return name.strip(), None, None
+    req = Requirement(line)
+    if req.marker is not None and not req.marker.evaluate():
+        return None
+    return req.name, req.specifier, line
+
+
+@functools.lru_cache(maxsize=None)
+def _check_cached(req_path: str, mtime_ns: int):
+    problems = []
+    with open(req_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    for raw in lines:
+        parsed = _parse_line(raw)
+        if parsed is None:
+            continue
+        name, specifier, line = parsed
+        try:
+            installed = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            problems.append(f"{name}: не установлен")
+            continue
+        if specifier and not specifier.contains(installed, prereleases=True):
+            problems.append(f"{line}: установлена версия {installed}")
+    return tuple(problems)
+
+
+def check_requirements(req_path) -> list:
+    # Список расхождений с requirements.txt; пустой — всё в порядке.
+    req_path = os.fspath(req_path)
+    try:
+        mtime_ns = os.stat(req_path).st_mtime_ns
+    except OSError:
+        return []
+    return list(_check_cached(req_path, mtime_ns))
+
+
+def main():
+    req_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "requirements.txt"
+    )
+    problems = check_requirements(req_path)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"Установите зависимости: {sys.executable} -m pip install -r {req_path}")
+        return 1
+    print("Все зависимости установлены.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
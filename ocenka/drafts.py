@@ -0,0 +1,280 @@
+# -----------------------------
+# ЧЕРНОВИКИ ФОРМЫ
+# -----------------------------
+# Пример: python -m ocenka.drafts --login ivanov   (что сохранено)
+#         python -m ocenka.drafts --sweep          (очистка)
+#
+# Поля формы и загруженные файлы живут только в st.session_state: обновление
+# страницы, обрыв websocket или перезапуск сервера теряют всё, и 50+ фото
+# приходится загружать заново. Черновик сохраняется по ходу заполнения и
+# восстанавливается по user_login.
+#
+# Раскладка в OCENKA_DRAFTS_DIR (по умолчанию data/drafts/):
+#   blobs/ab/<sha256>  — загруженные файлы по содержимому; файл, который уже
+#                        лежит на диске, повторно не пишется
+#   drafts.sqlite3     — один черновик на логин: поля (JSON) и списки файлов
+#                        по загрузчикам (имя, sha256, размер)
+#
+# Пишет один фоновый поток: save_async() не ждёт ни хеширования, ни диска.
+# SHA-256 загрузки запоминается по file_id — файл, загруженный раньше, при
+# следующих сохранениях не хешируется. Очистка — в том же потоке после
+# сохранения (не чаще раза в OCENKA_DRAFTS_SWEEP_S секунд): удаляются
+# черновики старше OCENKA_DRAFT_DAYS дней и файлы, на которые больше не
+# ссылается ни один черновик.
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from ocenka.output import write_atomic
+from ocenka.store import connect
+
+DRAFTS_DIR = Path(
+    os.environ.get("OCENKA_DRAFTS_DIR") or Path(__file__).resolve().parent.parent / "data" / "drafts"
+)
+DRAFT_DAYS = float(os.environ.get("OCENKA_DRAFT_DAYS", "14"))
+SWEEP_INTERVAL = float(os.environ.get("OCENKA_DRAFTS_SWEEP_S", "600"))
+# сколько file_id -> sha256 помнить
+DIGEST_MEMO = 4096
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    user_login TEXT PRIMARY KEY,
+    fields     TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS draft_files (
+    user_login TEXT NOT NULL REFERENCES drafts(user_login) ON DELETE CASCADE,
+    field      TEXT NOT NULL,
+    position   INTEGER NOT NULL,
+    name       TEXT NOT NULL,
+    sha256     TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    PRIMARY KEY (user_login, field, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_draft_files_sha ON draft_files(sha256);
+CREATE INDEX IF NOT EXISTS ix_drafts_updated ON drafts(updated_at);
+"""
+
+
+class DraftFile:
+    # файл из черновика вместо UploadedFile: те же name/size/file_id/getvalue(),
+    # байты читаются с диска только когда нужны (превью, рендер)
+    def __init__(self, name, sha256, size, path):
+        self.name = name
+        self.sha256 = sha256
+        self.size = size
+        self.path = Path(path)
+        self.file_id = f"draft:{sha256}"
+        self._data = None
+
+    def getvalue(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        return self.path.read_bytes()
+
+    def detach(self):
+        # черновик удаляется, а файл ещё в форме: держим байты в памяти,
+        # как обычную загрузку
+        if self._data is None:
+            self._data = self.path.read_bytes()
+
+
+class DraftStore:
+    def __init__(self, root=None):
+        self.root = Path(root or DRAFTS_DIR)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocenka-drafts")
+        self._local = threading.local()
+        self._digests = OrderedDict()   # file_id -> sha256, только в потоке записи
+        self._last_sweep = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.root / "drafts.sqlite3")
+            conn.executescript(SCHEMA)
+        return conn
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.root / "blobs" / sha256[:2] / sha256
+
+    # ---- запись ----
+    def save_async(self, user_login, fields: dict, files: dict):
+        # files: {загрузчик: [UploadedFile | DraftFile]}; -> Future(записано новых файлов)
+        files = {key: list(uploads) for key, uploads in files.items()}
+        return self._executor.submit(self._store, user_login, fields, files)
+
+    def save(self, user_login, fields: dict, files: dict) -> int:
+        return self.save_async(user_login, fields, files).result()
+
+    def _digest(self, uploaded) -> str:
+        digest = getattr(uploaded, "sha256", None)
+        if digest:
+            return digest
+        file_id = getattr(uploaded, "file_id", None)
+        digest = self._digests.get(file_id) if file_id else None
+        if digest is None:
+            digest = hashlib.sha256(uploaded.getvalue()).hexdigest()
+            if file_id:
+                self._digests[file_id] = digest
+                while len(self._digests) > DIGEST_MEMO:
+                    self._digests.popitem(last=False)
+        else:
+            self._digests.move_to_end(file_id)
+        return digest
+
+    def _store(self, user_login, fields, files):
+        conn = self._conn()
+        rows = []
+        written = 0
+        for key, uploads in files.items():
+            for position, uploaded in enumerate(uploads):
+                sha256 = self._digest(uploaded)
+                size = uploaded.size
+                known = conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+                path = self.blob_path(sha256)
+                if not known or not path.exists():
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    write_atomic(path, uploaded.getvalue())
+                    with conn:
+                        conn.execute("INSERT OR REPLACE INTO blobs (sha256, size) VALUES (?, ?)", (sha256, size))
+                    written += 1
+                rows.append((user_login, key, position, uploaded.name or "", sha256, size))
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO drafts (user_login, fields, updated_at) VALUES (?, ?, ?)",
+                (user_login, json.dumps(fields, ensure_ascii=False),
+                 datetime.now(timezone.utc).isoformat(timespec="seconds")),
+            )
+            conn.execute("DELETE FROM draft_files WHERE user_login = ?", (user_login,))
+            conn.executemany(
+                "INSERT INTO draft_files (user_login, field, position, name, sha256, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep()
+        return written
+
+    def delete(self, user_login):
+        return self._executor.submit(self._delete, user_login)
+
+    def _delete(self, user_login):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM drafts WHERE user_login = ?", (user_login,))
+        return self._collect_blobs()
+
+    # ---- чтение ----
+    def load(self, user_login):
+        # -> {'fields', 'files': {загрузчик: [DraftFile]}, 'updated_at', 'bytes'} | None;
+        # файлы, пропавшие с диска, пропускаются
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT fields, updated_at FROM drafts WHERE user_login = ?", (user_login,)
+        ).fetchone()
+        if row is None:
+            return None
+        files = {}
+        total = 0
+        for field, name, sha256, size in conn.execute(
+            "SELECT field, name, sha256, size FROM draft_files WHERE user_login = ? ORDER BY field, position",
+            (user_login,),
+        ):
+            path = self.blob_path(sha256)
+            if not path.exists():
+                continue
+            files.setdefault(field, []).append(DraftFile(name, sha256, size, path))
+            total += size
+        return {"fields": json.loads(row["fields"]), "files": files, "updated_at": row["updated_at"], "bytes": total}
+
+    # ---- очистка ----
+    def sweep(self):
+        return self._executor.submit(self._sweep).result()
+
+    def _sweep(self):
+        # -> (удалено черновиков, удалено файлов)
+        self._last_sweep = time.monotonic()
+        conn = self._conn()
+        drafts = 0
+        if DRAFT_DAYS > 0:
+            border = (datetime.now(timezone.utc) - timedelta(days=DRAFT_DAYS)).isoformat(timespec="seconds")
+            with conn:
+                drafts = conn.execute("DELETE FROM drafts WHERE updated_at < ?", (border,)).rowcount
+        return drafts, self._collect_blobs()
+
+    def _collect_blobs(self):
+        # файлы, на которые не ссылается ни один черновик
+        conn = self._conn()
+        orphans = [
+            sha256 for (sha256,) in conn.execute(
+                "SELECT sha256 FROM blobs WHERE NOT EXISTS "
+                "(SELECT 1 FROM draft_files WHERE draft_files.sha256 = blobs.sha256)"
+            ).fetchall()
+        ]
+        files = 0
+        for sha256 in orphans:
+            try:
+                self.blob_path(sha256).unlink()
+                files += 1
+            except FileNotFoundError:
+                pass
+        with conn:
+            conn.executemany("DELETE FROM blobs WHERE sha256 = ?", [(sha256,) for sha256 in orphans])
+        return files
+
+    def flush(self, timeout=None):
+        # дождаться всех поставленных сохранений
+        self._executor.submit(lambda: None).result(timeout)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        drafts, = conn.execute("SELECT COUNT(*) FROM drafts").fetchone()
+        blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"drafts": drafts, "blobs": blobs, "bytes": size}
+
+
+draft_store = DraftStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Черновики формы оценки.")
+    parser.add_argument("--login", help="показать черновик пользователя")
+    parser.add_argument("--delete", action="store_true", help="удалить черновик пользователя (--login)")
+    parser.add_argument("--sweep", action="store_true", help="удалить старые черновики и лишние файлы")
+    parser.add_argument("--dir", help="каталог черновиков (по умолчанию OCENKA_DRAFTS_DIR)")
+    args = parser.parse_args(argv)
+
+    store = DraftStore(args.dir) if args.dir else draft_store
+    if args.sweep:
+        drafts, files = store.sweep()
+        print(f"Удалено черновиков: {drafts}, файлов: {files}")
+    if args.login:
+        if args.delete:
+            files = store.delete(args.login).result()
+            print(f"Черновик {args.login} удалён, файлов: {files}")
+        draft = store.load(args.login)
+        if draft is None:
+            print(f"Черновика {args.login} нет")
+        else:
+            print(f"{args.login}  {draft['updated_at']}  {draft['bytes'] / 1024 / 1024:.1f} МБ")
+            for field, files in sorted(draft["files"].items()):
+                print(f"  {field}: " + ", ".join(item.name for item in files))
+    stats = store.stats()
+    print(f"Черновиков: {stats['drafts']}, файлов {stats['blobs']}, {stats['bytes'] / 1024 / 1024:.1f} МБ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# -----------------------------
+# ДИСКОВЫЙ КЕШ ОБРАБОТАННЫХ ИЗОБРАЖЕНИЙ
+# -----------------------------
+# Ключ — SHA-256 исходных байтов + параметры обработки (ширина в пикселях,
+# качество JPEG). Повторная отправка формы с теми же фото и фото аналогов,
+# кочующие между договорами, берутся из кеша без декодирования.
+# Вытеснение LRU по суммарному размеру: время доступа — mtime файла.
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+IMAGE_CACHE_DIR = Path(
+    os.environ.get("OCENKA_IMAGE_CACHE_DIR") or Path(__file__).resolve().parent.parent / "cache" / "images"
+)
+# 0 — кеш выключен
+IMAGE_CACHE_MAX_MB = int(os.environ.get("OCENKA_IMAGE_CACHE_MB", "512"))
+# после вытеснения оставляем запас, чтобы не чистить на каждой записи
+EVICT_TO_RATIO = 0.9
+
+
+def content_key(data: bytes, *params, digest: str = None) -> str:
+    # digest — уже посчитанный SHA-256 тех же байтов
+    digest = digest or hashlib.sha256(data).hexdigest()
+    if not params:
+        return digest
+    return digest + "_" + "_".join(str(p) for p in params)
+
+
+class ImageCache:
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str):
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # запись через временный файл + rename: читатели не увидят половину блоба
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except OSError:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += len(data)
+            need_evict = self._total > self.max_bytes
+        if need_evict:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for shard in self.directory.iterdir():
+            if not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                if path.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_total(self) -> int:
+        return sum(size for _mtime, size, _path in self._entries())
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _mtime, size, _path in entries)
+        limit = int(self.max_bytes * EVICT_TO_RATIO)
+        if total > self.max_bytes:
+            entries.sort()
+            for _mtime, size, path in entries:
+                if total <= limit:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+        with self._lock:
+            self._total = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total}
+
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,369 @@
+# -----------------------------
+# НОРМАЛИЗАЦИЯ ИЗОБРАЖЕНИЙ ПЕРЕД ВСТАВКОЙ В ОТЧЁТ
+# -----------------------------
+# Фото с телефона вставляются шириной 3 дюйма (таблицы фотографий) или
+# 140 мм (приложения), поэтому хранить в DOCX исходные 12 Мп бессмысленно.
+# Каждое изображение: поворот по EXIF, уменьшение до ширины под печать
+# с заданным DPI, удаление метаданных и перекодирование в JPEG/PNG.
+import io
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from ocenka.image_cache import content_key, image_cache
+from ocenka.uploads import BytesSource, release_items
+
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+
+# ширина, с которой картинки размещаются в документе
+PHOTO_WIDTH_INCHES = 3.0
+APPENDIX_WIDTH_MM = 140
+APPENDIX_WIDTH_INCHES = APPENDIX_WIDTH_MM / 25.4
+
+# настройки можно переопределить переменными окружения
+IMAGE_DPI = int(os.environ.get("OCENKA_IMAGE_DPI", "200"))
+JPEG_QUALITY = int(os.environ.get("OCENKA_JPEG_QUALITY", "82"))
+# пул обработки: "thread" (Pillow отпускает GIL при декодировании/сжатии)
+# или "process"; размер пула и тайм-аут на одно изображение в секундах
+IMAGE_POOL_KIND = os.environ.get("OCENKA_IMAGE_POOL", "thread")
+IMAGE_WORKERS = int(os.environ.get("OCENKA_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_TIMEOUT = float(os.environ.get("OCENKA_IMAGE_TIMEOUT", "30"))
+# как часто проверять, не началась ли обработка задания из очереди пула
+QUEUE_POLL_S = 0.1
+# одно и то же фото в наборах с разной шириной (фото объекта и приложение)
+# кладётся в документ один раз — самой широкой версией; 0 — выключить
+SHARE_WIDTH_VARIANTS = os.environ.get("OCENKA_IMAGE_SHARE_WIDTHS", "1") != "0"
+
+
+def is_image_file(name: str) -> bool:
+    return Path(name or '').suffix.lower() in IMAGE_SUFFIXES
+
+
+def target_width_px(width_inches: float, dpi: int = None) -> int:
+    return max(1, round(width_inches * (dpi or IMAGE_DPI)))
+
+
+def _has_alpha(img) -> bool:
+    if img.mode in ("RGBA", "LA", "PA"):
+        return True
+    return img.mode == "P" and "transparency" in img.info
+
+
+def normalize_image(data: bytes, width_inches: float, dpi: int = None, quality: int = None) -> bytes:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    max_width = target_width_px(width_inches, dpi)
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise ValueError("не удалось распознать изображение") from None
+    with img:
+        # JPEG умеет декодироваться сразу в уменьшенном масштабе (DCT scaling);
+        # запрашиваем квадрат, чтобы хватило при любом повороте из EXIF
+        img.draft("RGB", (max_width, max_width))
+        return encode_image(ImageOps.exif_transpose(img), max_width, quality)
+
+
+def encode_image(img, max_width: int, quality: int = None) -> bytes:
+    # уменьшение до max_width и перекодирование уже открытой картинки (PIL)
+    from PIL import Image
+
+    if img.width > max_width:
+        height = max(1, round(img.height * max_width / img.width))
+        img = img.resize((max_width, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    # метаданные (EXIF, GPS, комментарии) не переносим: save без exif/icc
+    if _has_alpha(img):
+        img.convert("RGBA").save(out, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(
+            out,
+            format="JPEG",
+            quality=quality or JPEG_QUALITY,
+            optimize=True,
+        )
+    return out.getvalue()
+
+
+def normalize_image_cached(data: bytes, width_inches: float, dpi: int = None, quality: int = None,
+                           digest: str = None):
+    # Возвращает (байты, взято_из_кеша). Хеширование тоже выполняется в пуле.
+    key = content_key(data, target_width_px(width_inches, dpi), quality or JPEG_QUALITY, digest=digest)
+    cached = image_cache.get(key)
+    if cached is not None:
+        return cached, True
+    result = normalize_image(data, width_inches, dpi, quality)
+    image_cache.put(key, result)
+    return result, False
+
+
+class ImageStats:
+    def __init__(self):
+        self.count = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.errors = 0
+        self.cached = 0
+        # версии под меньшую ширину, заменённые более широкой того же фото
+        self.shared = 0
+        self.shared_bytes = 0
+        # страницы PDF/TIFF сверх одной на файл (для прогресса рендера)
+        self.extra_pages = 0
+
+    def add(self, before: int, after: int, cached: bool = False):
+        self.count += 1
+        self.bytes_before += before
+        self.bytes_after += after
+        if cached:
+            self.cached += 1
+
+    def summary(self) -> str:
+        mb = 1024 * 1024
+        return (
+            f"Изображений: {self.count}, "
+            f"{self.bytes_before / mb:.1f} МБ → {self.bytes_after / mb:.1f} МБ, "
+            f"из кеша: {self.cached}"
+            + (f", повторов в разной ширине: {self.shared}" if self.shared else "")
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# момент фактического начала заданий пула: номер задания -> time.monotonic()
+# (часы общие для всех процессов машины). Для пула процессов — словарь
+# multiprocessing.Manager, его пишут дочерние процессы
+_started = {}
+_task_ids = itertools.count()
+
+
+def get_image_pool():
+    # общий на процесс пул: все сессии Streamlit делят одни и те же воркеры
+    global _pool, _started
+    with _pool_lock:
+        if _pool is None:
+            if IMAGE_POOL_KIND == "process":
+                if isinstance(_started, dict):
+                    import multiprocessing
+
+                    _started = multiprocessing.Manager().dict()
+                _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+            else:
+                _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="ocenka-img")
+        return _pool
+
+
+def _call_timed(started, task_id, fn, *args):
+    started[task_id] = time.monotonic()
+    return fn(*args)
+
+
+def submit_timed(pool, fn, *args):
+    # как pool.submit, но воркер отмечает, когда задание реально началось
+    task_id = next(_task_ids)
+    future = pool.submit(_call_timed, _started, task_id, fn, *args)
+    future.task_id = task_id
+    return future
+
+
+def result_within_timeout(future):
+    # IMAGE_TIMEOUT отсчитывается от начала обработки, а не от постановки в
+    # очередь: в общем пуле задание может ждать чужие фото и миниатюры.
+    # Пока задание в очереди, ждём без ограничения. Зависшую обработку в
+    # потоке прервать нельзя — её результат просто не используется
+    try:
+        while True:
+            start = _started.get(future.task_id)
+            if start is not None:
+                return future.result(timeout=max(0.0, start + IMAGE_TIMEOUT - time.monotonic()))
+            try:
+                return future.result(timeout=QUEUE_POLL_S)
+            except FutureTimeoutError:
+                continue
+    finally:
+        _started.pop(future.task_id, None)
+
+
+def _reset_image_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def normalize_source_cached(source, width_inches: float, dpi: int = None, quality: int = None):
+    # Исходник читается уже в пуле: в памяти одновременно только те
+    # оригиналы, что сейчас обрабатываются.
+    # Возвращает (байты, из_кеша, было_байт, sha256 исходника).
+    data = source.read()
+    digest = content_key(data)
+    result, cached = normalize_image_cached(data, width_inches, dpi, quality, digest)
+    return result, cached, len(data), digest
+
+
+def share_width_variants(jobs, processed_items, stats: ImageStats = None):
+    # Одно и то же исходное фото, обработанное под разные ширины, заменяем
+    # самой широкой версией: в таблице фото она просто масштабируется, а
+    # одинаковые байты python-docx хранит в word/media одной частью.
+    widest = {}
+    for _batch_idx, item, width_inches in jobs:
+        processed = processed_items.get(id(item))
+        if processed is None:
+            continue
+        best = widest.get(processed['source_sha256'])
+        if best is None or width_inches > best[0]:
+            widest[processed['source_sha256']] = (width_inches, processed)
+    replaced = set()
+    for _batch_idx, item, width_inches in jobs:
+        processed = processed_items.get(id(item))
+        if processed is None:
+            continue
+        best_width, best = widest[processed['source_sha256']]
+        # та же ширина или уже те же байты — не вариант ширины: одинаковые
+        # картинки сведёт в одну часть dedupe_media
+        if width_inches == best_width or best['data'] == processed['data']:
+            continue
+        if (processed['source_sha256'], width_inches) not in replaced:
+            replaced.add((processed['source_sha256'], width_inches))
+            if stats is not None:
+                stats.shared += 1
+                stats.shared_bytes += processed['size']
+        processed['data'] = best['data']
+        processed['size'] = best['size']
+
+
+def expand_pages(batches, pool, stats: ImageStats = None):
+    # PDF и многостраничные TIFF -> по записи на страницу (ocenka.pages);
+    # число страниц всех файлов узнаём в пуле параллельно
+    from ocenka.pages import MAX_PAGES, is_paged_file, page_items, read_pages
+
+    counting = {
+        id(item): submit_timed(pool, read_pages, item.get('source') or BytesSource(item['data']))
+        for files, _width, _failures in batches
+        for item in files
+        if is_paged_file(item.get('name'))
+    }
+    if not counting:
+        return batches
+    expanded = []
+    for files, width_inches, failures in batches:
+        batch_files = []
+        for item in files:
+            future = counting.get(id(item))
+            if future is None:
+                batch_files.append(item)
+                continue
+            name = item.get('name') or 'без названия'
+            try:
+                data, digest, count = result_within_timeout(future)
+            except FutureTimeoutError:
+                future.cancel()
+                failures.append(f"{name} (превышено время обработки {IMAGE_TIMEOUT:g} с)")
+                count = None
+            except Exception as exc:
+                failures.append(f"{name} (ошибка обработки: {exc})")
+                count = None
+            else:
+                pages = page_items(item, data, digest, count)
+                if not pages:
+                    failures.append(f"{name} (в файле нет страниц)")
+                elif count > MAX_PAGES:
+                    failures.append(f"{name} (в отчёт вошли первые {MAX_PAGES} из {count} стр.)")
+                if stats is not None:
+                    stats.extra_pages += len(pages) - 1
+                batch_files.extend(pages)
+            if count is None and stats is not None:
+                stats.errors += 1
+            release_items([item])
+        expanded.append((batch_files, width_inches, failures))
+    return expanded
+
+
+def normalize_batches(batches, stats: ImageStats = None, dpi: int = None, quality: int = None):
+    # batches: список (files, width_inches, failures). Изображения всех наборов
+    # идут в общий пул скользящим окном (не больше двух на воркер),
+    # результаты собираются в порядке загрузки. Битый файл или превышение
+    # тайм-аута — запись в failures соответствующего набора, файл в отчёт
+    # не попадает. Исходник вложения отпускается сразу после обработки.
+    # PDF и многостраничные TIFF заранее разворачиваются в страницы.
+    # Остальные файлы декодируются независимо от расширения: JPEG с именем
+    # «photo» встаёт в отчёт, не-картинка уходит в failures.
+    from ocenka.pages import rasterize_page_cached  # ocenka.pages импортирует этот модуль
+
+    pool = get_image_pool()
+    batches = expand_pages(batches, pool, stats)
+    jobs = []
+    for batch_idx, (files, width_inches, _failures) in enumerate(batches):
+        for item in files:
+            jobs.append((batch_idx, item, width_inches))
+
+    in_flight = {}
+    window = max(1, IMAGE_WORKERS * 2)
+
+    def submit(job_idx):
+        if job_idx < len(jobs):
+            _batch_idx, item, width_inches = jobs[job_idx]
+            source = item.get('source') or BytesSource(item['data'])
+            if 'page' in item:
+                in_flight[job_idx] = submit_timed(
+                    pool, rasterize_page_cached, source, item['digest'], item['page'], width_inches, dpi, quality
+                )
+            else:
+                in_flight[job_idx] = submit_timed(pool, normalize_source_cached, source, width_inches, dpi, quality)
+
+    for job_idx in range(window):
+        submit(job_idx)
+
+    processed_items = {}
+    for job_idx, (batch_idx, item, _width) in enumerate(jobs):
+        future = in_flight.pop(job_idx)
+        failures = batches[batch_idx][2]
+        name = item.get('name') or 'без названия'
+        if 'page' in item and item['pages'] > 1:
+            name = f"{name}, стр. {item['page'] + 1}"
+        try:
+            data, cached, before, digest = result_within_timeout(future)
+        except FutureTimeoutError:
+            future.cancel()
+            failures.append(f"{name} (превышено время обработки {IMAGE_TIMEOUT:g} с)")
+            if stats is not None:
+                stats.errors += 1
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                _reset_image_pool()
+                pool = get_image_pool()
+            failures.append(f"{name} (ошибка обработки: {exc})")
+            if stats is not None:
+                stats.errors += 1
+        else:
+            if stats is not None:
+                stats.add(before, len(data), cached)
+            processed_items[id(item)] = {
+                'name': item.get('name'),
+                'data': data,
+                'size': len(data),
+                'original_size': before,
+                'source_sha256': digest,
+            }
+            if 'page' in item:
+                processed_items[id(item)].update(page=item['page'], pages=item['pages'])
+        release_items([item])
+        submit(job_idx + window)
+
+    if SHARE_WIDTH_VARIANTS:
+        share_width_variants(jobs, processed_items, stats)
+
+    results = []
+    for files, _width, _failures in batches:
+        processed = []
+        for item in files:
+            if id(item) in processed_items:
+                processed.append(processed_items[id(item)])
+        results.append(processed)
+    return results
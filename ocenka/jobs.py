@@ -0,0 +1,246 @@
+# -----------------------------
+# ФОНОВЫЕ ЗАДАНИЯ РЕНДЕРА
+# -----------------------------
+# Отправка формы только ставит задание в очередь и сразу возвращает
+# управление скрипту Streamlit; идентификатор задания лежит в
+# st.session_state, страница опрашивает его статус и показывает кнопку
+# скачивания, когда отчёт готов.
+#
+# Пул общий на процесс: одновременно рендерится не больше
+# OCENKA_RENDER_WORKERS отчётов (по умолчанию 2), всего в работе и в очереди
+# не больше OCENKA_RENDER_QUEUE (по умолчанию 16) — остальные отправки
+# получают отказ.
+# Обработка фото внутри рендера идёт в общем пуле ocenka.images, поэтому
+# параллельные задания не умножают число потоков декодирования.
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from ocenka.images import ImageStats
+from ocenka.metrics import RenderTrace
+from ocenka.archive import report_archive
+from ocenka.profiling import start_profile
+from ocenka.service import RENDER_SERVICE_URL, RenderClient, report_files
+from ocenka.render import (
+    TEMPLATE_PATH,
+    RECORD_FILE_SECTIONS,
+    prepare_images,
+    release_report,
+    render_document,
+    report_failures,
+    serialize_document,
+)
+
+RENDER_WORKERS = max(1, int(os.environ.get("OCENKA_RENDER_WORKERS") or min(2, os.cpu_count() or 1)))
+RENDER_QUEUE = max(1, int(os.environ.get("OCENKA_RENDER_QUEUE", "16")))
+# сколько секунд держать готовый отчёт в памяти после завершения
+JOB_TTL = int(os.environ.get("OCENKA_JOB_TTL", "3600"))
+
+# порядок этапов — для полосы прогресса
+STAGES = ("queued", "images", "template", "appendix", "photos", "render", "save", "done")
+# при рендере в сервисе (OCENKA_RENDER_SERVICE) этапы идут в воркере
+# сервиса, здесь виден только этап «service»
+STAGE_LABELS = {
+    "queued": "В очереди",
+    "images": "Обработка фотографий",
+    "template": "Загрузка шаблона",
+    "appendix": "Приложения",
+    "photos": "Вставка фотографий в документ",
+    "render": "Подстановка данных в шаблон",
+    "save": "Сохранение DOCX",
+    "service": "Рендер в сервисе",
+    "done": "Готово",
+    "error": "Ошибка",
+}
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class RenderJob:
+    def __init__(self, report, report_id, out_name, images_total: int):
+        self.id = uuid.uuid4().hex
+        self.report_id = report_id
+        self.created = time.time()
+        self.finished = None
+        self.status = "queued"          # queued / running / done / error
+        self.stage = "queued"
+        self.images_total = images_total
+        self.image_stats = ImageStats()
+        # имя файла для скачивания; путь в архиве известен после рендера
+        self.out_name = out_name
+        self.out_path = None
+        self.data = None
+        self.failures = []
+        self.error = None
+        self.profile_path = None
+        self.profile_top = None
+        self._report = report
+
+    @property
+    def images_done(self) -> int:
+        return self.image_stats.count + self.image_stats.errors
+
+    @property
+    def images_expected(self) -> int:
+        # число страниц PDF/TIFF становится известно уже в обработке
+        return self.images_total + self.image_stats.extra_pages
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        stage = self.stage if self.stage in STAGES else "queued"
+        position = STAGES.index(stage)
+        fraction = position / (len(STAGES) - 1)
+        if stage == "images" and self.images_expected > 0:
+            fraction += min(1.0, self.images_done / self.images_expected) / (len(STAGES) - 1)
+        return min(fraction, 0.99)
+
+    def describe(self) -> str:
+        label = STAGE_LABELS.get(self.stage, self.stage)
+        if self.stage == "images" and self.images_expected > 0:
+            return f"{label}: {self.images_done} из {self.images_expected}"
+        return label
+
+    def _set_stage(self, name):
+        self.stage = name
+
+
+def _count_images(report) -> int:
+    files = [item for _key, files_key, _fail in RECORD_FILE_SECTIONS for item in report[files_key]]
+    files += [item for analog in report['analogs'] for item in analog['files']]
+    # каждый файл — хотя бы одно изображение (страницы PDF/TIFF добавятся в обработке)
+    return len(files)
+
+
+def _render_in_service(job: RenderJob, report, trace):
+    # фото обрабатываются и встраиваются воркером сервиса; локально только
+    # читаем загрузки и отправляем их вместе с записью
+    files = report_files(report)
+    release_report(report)
+    with trace.stage("service", bytes_in=sum(len(data) for _name, data in files)) as stage:
+        data, failures = RenderClient(RENDER_SERVICE_URL).render(report['record'], files)
+        stage.bytes_out = len(data)
+    # ошибки чтения загрузок известны только здесь, ошибки обработки — сервису
+    job.failures = list(dict.fromkeys(report_failures(report) + failures))
+    return data
+
+
+def _run(job: RenderJob, template_path, trace, profile_enabled):
+    report = job._report
+    job._report = None
+    job.status = "running"
+    trace.on_stage = job._set_stage
+    profile = None
+    try:
+        if RENDER_SERVICE_URL:
+            data = _render_in_service(job, report, trace)
+        else:
+            prepare_images(report, job.image_stats, trace)
+            # start_profile не бросает: без профиля рендер идёт как обычно
+            profile = start_profile(profile_enabled)
+            try:
+                doc = render_document(report, template_path, trace)
+                data = serialize_document(doc, trace)
+            finally:
+                if profile is not None:
+                    profile.stop()
+            job.failures = report_failures(report)
+    except Exception as exc:
+        job.error = f"{exc.__class__.__name__}: {exc}"
+        job.stage = job.status = "error"
+        job.finished = time.time()
+        _write_trace(trace, out_name=job.out_name, report_id=job.report_id, error=job.error)
+        return
+    finally:
+        trace.on_stage = None
+
+    # отчёт готов: дальше только архив, замеры и профиль. Задание в любом
+    # случае завершается — иначе страница опрашивала бы его бесконечно,
+    # а место в очереди не освобождалось
+    record = report['record']
+    try:
+        job.out_path, _saved = report_archive.put_async(
+            job.report_id, data, job.out_name, record.get("Номер договора"), record.get("user_uuid")
+        )
+    except Exception as exc:
+        job.error = f"{exc.__class__.__name__}: {exc}"
+        job.stage = job.status = "error"
+        job.finished = time.time()
+        _write_trace(trace, out_name=job.out_name, report_id=job.report_id, error=job.error)
+        return
+    job.data = data
+    try:
+        _write_trace(trace, out_name=job.out_name, report_id=job.report_id)
+        if profile is not None:
+            try:
+                job.profile_path = profile.save(report_archive.root, record)
+                job.profile_top = profile.top()
+            except Exception as exc:
+                print("Не удалось сохранить профиль рендера:", exc)
+    finally:
+        job.finished = time.time()
+        job.stage = job.status = "done"
+
+
+def _write_trace(trace, **fields):
+    # сбой журнала замеров не должен ронять задание
+    try:
+        trace.write(**fields)
+    except Exception as exc:
+        print("Не удалось записать метрики рендера:", exc)
+
+
+class RenderQueue:
+    def __init__(self, workers=RENDER_WORKERS, limit=RENDER_QUEUE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._limit = limit
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > JOB_TTL:
+                del self._jobs[job_id]
+
+    def submit(self, report, report_id, out_name, template_path=TEMPLATE_PATH, trace=None, profile=False) -> RenderJob:
+        trace = trace if trace is not None else RenderTrace()
+        job = RenderJob(report, report_id, out_name, _count_images(report))
+        with self._lock:
+            self._prune()
+            pending = sum(1 for other in self._jobs.values() if other.active)
+            if pending >= self._limit:
+                raise QueueFull(pending)
+            self._jobs[job.id] = job
+        self._executor.submit(_run, job, template_path, trace, profile)
+        return job
+
+    def get(self, job_id) -> RenderJob:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def forget(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.active:
+                del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(1 for job in jobs if job.status == "queued"),
+            "running": sum(1 for job in jobs if job.status == "running"),
+            "finished": sum(1 for job in jobs if not job.active),
+        }
+
+
+render_queue = RenderQueue()
@@ -0,0 +1,324 @@
+# -----------------------------
+# ЗАМЕРЫ ЭТАПОВ ФОРМИРОВАНИЯ ОТЧЁТА
+# -----------------------------
+# Каждый рендер собирает RenderTrace: по этапам (чтение загрузок, обработка
+# изображений, приложения, таблицы фото, doc.render, сохранение ...) — время
+# по часам, процессорное время потока и байты на входе/выходе. В конце
+# рендера трасса дописывается одной JSON-строкой в OCENKA_METRICS_LOG.
+# Сводка p50/p95 по этапам: боковая панель администратора в main.py или
+# `python -m ocenka.metrics`.
+#
+# Журнал ротируется по размеру: когда он перерастает OCENKA_METRICS_LOG_MB,
+# он переименовывается в <имя>.1 (прошлый .1 удаляется). Сводка читает с
+# конца файла только последние SUMMARY_WINDOW строк (при нехватке — хвост .1)
+# и кешируется по (mtime, размер), поэтому перезапуски сайдбара журнал заново
+# не разбирают.
+#
+# CPU считается через time.thread_time(): работа пула изображений в других
+# потоках в cpu_s этапа «images» не попадает, её видно по wall_s.
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from stat import S_ISREG
+
+METRICS_LOG = Path(
+    os.environ.get("OCENKA_METRICS_LOG") or Path(__file__).resolve().parent.parent / "logs" / "render_metrics.jsonl"
+)
+# при каком размере журнал уходит в <имя>.1; 0 — не ротировать
+METRICS_LOG_MB = float(os.environ.get("OCENKA_METRICS_LOG_MB", "16"))
+# сколько последних рендеров учитывать в сводке
+SUMMARY_WINDOW = 1000
+# блок чтения журнала с конца
+TAIL_BLOCK = 64 * 1024
+
+_log_lock = threading.Lock()
+_recent_lock = threading.Lock()
+_recent_cache = {}   # (путь, limit) -> (ключ файлов, записи)
+
+
+class Stage:
+    def __init__(self, trace, name, bytes_in=0):
+        self.trace = trace
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._stopped = False
+
+    def stop(self, bytes_in=None, bytes_out=None):
+        if self._stopped:
+            return
+        self._stopped = True
+        if bytes_in is not None:
+            self.bytes_in = bytes_in
+        if bytes_out is not None:
+            self.bytes_out = bytes_out
+        self.trace.add(
+            self.name,
+            time.perf_counter() - self._wall,
+            time.thread_time() - self._cpu,
+            self.bytes_in,
+            self.bytes_out,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+class RenderTrace:
+    def __init__(self, **meta):
+        self.meta = meta
+        self.stages = OrderedDict()
+        # счётчики событий рендера (попадания в кеши и т. п.)
+        self.counters = OrderedDict()
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        # вызывается с именем этапа при его начале (прогресс фонового рендера)
+        self.on_stage = None
+
+    def stage(self, name, bytes_in=0) -> Stage:
+        if self.on_stage is not None:
+            self.on_stage(name)
+        return Stage(self, name, bytes_in)
+
+    def add(self, name, wall_s, cpu_s, bytes_in=0, bytes_out=0):
+        with self._lock:
+            acc = self.stages.get(name)
+            if acc is None:
+                acc = self.stages[name] = {"wall_s": 0.0, "cpu_s": 0.0, "bytes_in": 0, "bytes_out": 0, "calls": 0}
+            acc["wall_s"] += wall_s
+            acc["cpu_s"] += cpu_s
+            acc["bytes_in"] += bytes_in
+            acc["bytes_out"] += bytes_out
+            acc["calls"] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self, **extra) -> dict:
+        with self._lock:
+            stages = {
+                name: {key: round(value, 6) if isinstance(value, float) else value for key, value in values.items()}
+                for name, values in self.stages.items()
+            }
+            counters = dict(self.counters)
+        entry = {
+            "ts": round(self.started_at, 3),
+            "total_s": round(time.perf_counter() - self._started, 4),
+            **self.meta,
+            **extra,
+            "stages": stages,
+        }
+        if counters:
+            entry["counters"] = counters
+        return entry
+
+    def write(self, path=None, **extra) -> dict:
+        entry = self.to_dict(**extra)
+        path = Path(path or METRICS_LOG)
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with _log_lock:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                _rotate(path)
+        except OSError as exc:
+            print("Не удалось записать метрики рендера:", exc)
+        return entry
+
+
+def _rotate(path: Path):
+    # под _log_lock; журнал пишут и процессы ocenka.cli, поэтому размер берём
+    # у файла на диске: другой процесс мог уже переименовать его сам
+    if METRICS_LOG_MB <= 0:
+        return
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return
+    if S_ISREG(stat.st_mode) and stat.st_size > METRICS_LOG_MB * 1024 * 1024:
+        try:
+            os.replace(path, backup_path(path))
+        except FileNotFoundError:
+            pass
+
+
+class _NullStage:
+    def stop(self, bytes_in=None, bytes_out=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTrace:
+    # заглушка, когда замеры не нужны (например, прогрев шаблона)
+    def stage(self, name, bytes_in=0):
+        return _NullStage()
+
+    def add(self, *args, **kwargs):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+# -----------------------------
+# СВОДКА
+# -----------------------------
+def backup_path(path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + ".1")
+
+
+def _file_key(path: Path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _tail_lines(path: Path, limit: int):
+    # последние limit непустых строк файла, читаем блоками с конца
+    if limit <= 0 or not path.is_file():
+        return []
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b""
+        while pos > 0 and tail.count(b"\n") <= limit:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+    lines = [line for line in tail.split(b"\n") if line.strip()]
+    # первая строка блока может быть обрезана, если до начала файла не дошли
+    if pos > 0 and lines:
+        lines = lines[1:]
+    return lines[-limit:]
+
+
+def _parse(lines):
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+def read_recent(path=None, limit=SUMMARY_WINDOW):
+    path = Path(path or METRICS_LOG)
+    backup = backup_path(path)
+    key = (_file_key(path), _file_key(backup))
+    with _recent_lock:
+        cached = _recent_cache.get((path, limit))
+    if cached is not None and cached[0] == key:
+        return list(cached[1])
+    entries = _parse(_tail_lines(path, limit))
+    if len(entries) < limit:
+        entries = _parse(_tail_lines(backup, limit - len(entries))) + entries
+    with _recent_lock:
+        _recent_cache[(path, limit)] = (key, entries)
+    return list(entries)
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def summarize(entries):
+    # {этап: {'count', 'p50_s', 'p95_s', 'cpu_p50_s', 'bytes_in_p50', 'bytes_out_p50'}}, плюс 'total'
+    per_stage = OrderedDict()
+    totals = []
+    for entry in entries:
+        totals.append(entry.get("total_s", 0.0))
+        for name, values in (entry.get("stages") or {}).items():
+            per_stage.setdefault(name, []).append(values)
+    summary = OrderedDict()
+    for name, rows in per_stage.items():
+        summary[name] = {
+            "count": len(rows),
+            "p50_s": _percentile([r["wall_s"] for r in rows], 0.5),
+            "p95_s": _percentile([r["wall_s"] for r in rows], 0.95),
+            "cpu_p50_s": _percentile([r["cpu_s"] for r in rows], 0.5),
+            "bytes_in_p50": _percentile([r["bytes_in"] for r in rows], 0.5),
+            "bytes_out_p50": _percentile([r["bytes_out"] for r in rows], 0.5),
+        }
+    summary["total"] = {
+        "count": len(totals),
+        "p50_s": _percentile(totals, 0.5),
+        "p95_s": _percentile(totals, 0.95),
+        "cpu_p50_s": 0.0,
+        "bytes_in_p50": 0.0,
+        "bytes_out_p50": 0.0,
+    }
+    return summary
+
+
+def format_summary(summary) -> str:
+    lines = [f"{'этап':<16}{'n':>6}{'p50, с':>10}{'p95, с':>10}{'cpu p50':>10}{'вход p50':>12}{'выход p50':>12}"]
+    for name, row in summary.items():
+        lines.append(
+            f"{name:<16}{row['count']:>6}{row['p50_s']:>10.3f}{row['p95_s']:>10.3f}"
+            f"{row['cpu_p50_s']:>10.3f}{row['bytes_in_p50'] / 1024:>10.0f}КБ{row['bytes_out_p50'] / 1024:>10.0f}КБ"
+        )
+    return "\n".join(lines)
+
+
+def sum_counters(entries) -> dict:
+    totals = OrderedDict()
+    for entry in entries:
+        for name, value in (entry.get("counters") or {}).items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def format_cache_rate(counters) -> str:
+    hits = counters.get("subdoc_hits", 0)
+    lookups = hits + counters.get("subdoc_misses", 0)
+    if not lookups:
+        return ""
+    return f"Кеш таблиц фото: попаданий {hits} из {lookups} ({hits / lookups:.0%})"
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    entries = read_recent(path)
+    if not entries:
+        print("Замеров пока нет.")
+        return 0
+    print(format_summary(summarize(entries)))
+    cache_rate = format_cache_rate(sum_counters(entries))
+    if cache_rate:
+        print(cache_rate)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
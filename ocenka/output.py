@@ -0,0 +1,178 @@
+# -----------------------------
+# ВЫДАЧА ГОТОВОГО ОТЧЁТА
+# -----------------------------
+# Документ сериализуется один раз в память, эти же байты отдаются кнопке
+# скачивания, а копия в архив (ocenka.archive) пишется фоновым потоком.
+#
+# Пакет пишется своим writer'ом вместо doc.save: python-docx сжимает
+# deflate каждую часть, включая JPEG/PNG, которые от этого не уменьшаются.
+# Здесь уже сжатые картинки кладутся в zip как есть (stored), XML и прочее —
+# deflate уровня OCENKA_DOCX_DEFLATE_LEVEL. Части пишутся в поток по одной.
+#
+# Writer опирается на внутренние методы python-docx (PackageWriter._write_*),
+# поэтому версия python-docx в requirements.txt ограничена проверенными.
+# Если в установленной версии их нет или сигнатура другая
+# (AttributeError/TypeError), отчёт сохраняется обычным doc.save.
+import hashlib
+import io
+import os
+import re
+import tempfile
+import zipfile
+from pathlib import Path
+
+# форматы, которые deflate не уменьшает
+STORED_SUFFIXES = {".jpeg", ".jpg", ".png", ".gif", ".webp", ".wdp"}
+# 1 — быстрее, 9 — меньше; 6 — как у zlib по умолчанию
+DEFLATE_LEVEL = int(os.environ.get("OCENKA_DOCX_DEFLATE_LEVEL", "6"))
+# время изменения частей в zip — минимальное, которое допускает формат
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# в именах файлов оставляем буквы, цифры, точку, дефис и подчёркивание
+UNSAFE_NAME_CHARS = re.compile(r"[^\w.-]+")
+
+
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+def dedupe_media(doc):
+    # Одинаковые по байтам картинки (тело, подтаблицы фото, колонтитулы)
+    # оставляем в word/media одной частью: ссылки переводятся на первую,
+    # лишние части без ссылок при сохранении в пакет не попадают.
+    # -> (убрано частей, сэкономлено байт)
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.opc.part import XmlPart
+    from lxml import etree
+
+    find_refs = etree.XPath("//@*[namespace-uri() = $ns and . = $rid]")
+
+    # у DocxTemplate отрисованный документ — атрибут docx (get_docx() после
+    # рендера перечитал бы шаблон)
+    docx = getattr(doc, "docx", doc)
+    canonical = {}
+    dropped = {}
+    for part in list(docx.part.package.iter_parts()):
+        for rel in list(part.rels.values()):
+            if rel.is_external or rel.reltype != RT.IMAGE:
+                continue
+            target = rel.target_part
+            first = canonical.setdefault(hashlib.sha256(target.blob).digest(), target)
+            if first is target or not isinstance(part, XmlPart):
+                continue
+            new_rid = part.relate_to(first, RT.IMAGE)
+            for attr in find_refs(part.element, ns=REL_NS, rid=rel.rId):
+                attr.getparent().set(attr.attrname, new_rid)
+            del part.rels[rel.rId]
+            dropped[target.partname] = len(target.blob)
+    return len(dropped), sum(dropped.values())
+
+
+class MediaAwareZipWriter:
+    # интерфейс PhysPkgWriter из python-docx: write(pack_uri, blob), close()
+    def __init__(self, target, deflate_level=None):
+        self._zipf = zipfile.ZipFile(target, "w")
+        self.deflate_level = DEFLATE_LEVEL if deflate_level is None else deflate_level
+
+    def write(self, pack_uri, blob):
+        # время записи у всех частей одно и то же: одинаковые отчёты
+        # совпадают байт в байт и хранятся в архиве один раз
+        info = zipfile.ZipInfo(pack_uri.membername, date_time=ZIP_DATE_TIME)
+        info.external_attr = 0o600 << 16
+        if os.path.splitext(info.filename)[1].lower() in STORED_SUFFIXES:
+            info.compress_type = zipfile.ZIP_STORED
+            self._zipf.writestr(info, blob)
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self._zipf.writestr(info, blob, compresslevel=self.deflate_level)
+
+    def close(self):
+        self._zipf.close()
+
+
+def _package_writer():
+    # внутренние методы python-docx -> (типы, связи пакета, части) | None
+    from docx.opc.pkgwriter import PackageWriter
+
+    try:
+        return (PackageWriter._write_content_types_stream, PackageWriter._write_pkg_rels,
+                PackageWriter._write_parts)
+    except AttributeError:
+        return None
+
+
+def _rewind_position(target):
+    # откуда писали: 0 для пути, позиция для файла с seek, None — не перемотать
+    if isinstance(target, (str, os.PathLike)):
+        return 0
+    try:
+        return target.tell() if target.seekable() else None
+    except (AttributeError, OSError):
+        return None
+
+
+def write_docx(doc, target, deflate_level=None):
+    # target — путь или файловый объект (в т.ч. без seek, например ответ HTTP).
+    # Порядок частей тот же, что у OpcPackage.save.
+    if any(getattr(doc, name, None) for name in ("pics_to_replace", "crc_to_new_media",
+                                                 "crc_to_new_embedded", "zipname_to_replace")):
+        # замены картинок/вложений docxtpl делает внутри своего save (время
+        # записи частей там текущее — такие отчёты в архиве не совпадают)
+        doc.save(target)
+        return
+    api = _package_writer()
+    if api is None:
+        doc.save(target)
+        return
+    write_content_types, write_pkg_rels, write_parts = api
+    start = _rewind_position(target)
+    package = getattr(doc, "docx", doc).part.package
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+    try:
+        writer = MediaAwareZipWriter(target, deflate_level)
+        try:
+            write_content_types(writer, parts)
+            write_pkg_rels(writer, package.rels)
+            write_parts(writer, parts)
+        finally:
+            writer.close()
+    except (AttributeError, TypeError) as exc:
+        # другая версия python-docx; в поток без seek частичный zip уже ушёл
+        if start is None:
+            raise
+        print("Свой writer DOCX не подошёл к python-docx, сохраняем через doc.save:", exc)
+        if not isinstance(target, (str, os.PathLike)):
+            target.seek(start)
+            target.truncate()
+        doc.save(target)
+
+
+def render_to_bytes(doc) -> bytes:
+    buffer = io.BytesIO()
+    write_docx(doc, buffer)
+    # getvalue() отдаёт внутренний буфер BytesIO без копирования,
+    # после выхода из функции в памяти остаётся одна копия отчёта
+    return buffer.getvalue()
+
+
+def safe_file_part(value) -> str:
+    # часть имени файла из ввода пользователя: номер договора «12/34» не
+    # должен превращаться в подкаталог
+    return UNSAFE_NAME_CHARS.sub("_", str(value)).strip("._") or "_"
+
+
+def write_atomic(path, data: bytes):
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=path.suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    return path
+
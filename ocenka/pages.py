@@ -0,0 +1,138 @@
+# -----------------------------
+# МНОГОСТРАНИЧНЫЕ ВЛОЖЕНИЯ: PDF И TIFF
+# -----------------------------
+# Сканы документов (права оценщика, приложения) обычно приходят в PDF или
+# многостраничном TIFF. Каждая страница растрируется в картинку под ширину
+# приложения с тем же DPI, что и фото (OCENKA_IMAGE_DPI), и дальше идёт как
+# обычное изображение: InlineImage в приложении, строка в таблице фото.
+#
+# Файл разворачивается в страницы в два шага, оба в общем пуле обработки
+# изображений: сначала число страниц, затем каждая страница отдельным
+# заданием — страницы одного документа конвертируются параллельно.
+# Готовые страницы лежат в дисковом кеше изображений по ключу
+# (SHA-256 файла, номер страницы, ширина в пикселях, качество JPEG), число
+# страниц — тоже: повторная отправка и кочующие между отчётами документы
+# (лицензия оценщика) не растрируются заново.
+#
+# PDF рендерит pypdfium2. PDFium не потокобезопасен: в пуле потоков вызовы
+# PDFium идут по одному под блокировкой, уменьшение и сжатие JPEG — уже
+# параллельно; в пуле процессов (OCENKA_IMAGE_POOL=process) параллельно всё.
+import io
+import threading
+from pathlib import Path
+
+from ocenka.image_cache import content_key, image_cache
+from ocenka.images import JPEG_QUALITY, encode_image, target_width_px
+from ocenka.uploads import BytesSource
+
+PDF_SUFFIXES = {'.pdf'}
+TIFF_SUFFIXES = {'.tif', '.tiff'}
+# больше страниц из одного файла в отчёт не кладём
+MAX_PAGES = 200
+
+_pdfium_lock = threading.Lock()
+
+
+def is_paged_file(name: str) -> bool:
+    return Path(name or '').suffix.lower() in PDF_SUFFIXES | TIFF_SUFFIXES
+
+
+def _is_pdf(data: bytes) -> bool:
+    return data[:1024].lstrip().startswith(b"%PDF")
+
+
+def _open_pdf(data: bytes):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise ValueError("для PDF нужен пакет pypdfium2") from None
+    try:
+        return pdfium.PdfDocument(data)
+    except pdfium.PdfiumError as exc:
+        raise ValueError(f"не удалось открыть PDF: {exc}") from None
+
+
+def _open_tiff(data: bytes):
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        return Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        raise ValueError("не удалось распознать изображение") from None
+
+
+def count_pages(data: bytes) -> int:
+    if _is_pdf(data):
+        with _pdfium_lock:
+            pdf = _open_pdf(data)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    with _open_tiff(data) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def rasterize_page(data: bytes, page: int, width_inches: float, dpi: int = None, quality: int = None) -> bytes:
+    # страница page (с нуля) -> JPEG/PNG шириной под печать
+    max_width = target_width_px(width_inches, dpi)
+    if _is_pdf(data):
+        with _pdfium_lock:
+            pdf = _open_pdf(data)
+            try:
+                pdf_page = pdf[page]
+                # масштаб 1 — 72 точки на дюйм; сразу рендерим в нужную ширину
+                bitmap = pdf_page.render(scale=max_width / pdf_page.get_width())
+                img = bitmap.to_pil()
+            finally:
+                pdf.close()
+        return encode_image(img, max_width, quality)
+    from PIL import ImageOps
+
+    with _open_tiff(data) as img:
+        img.seek(page)
+        return encode_image(ImageOps.exif_transpose(img), max_width, quality)
+
+
+def read_pages(source):
+    # в пуле: -> (байты файла, SHA-256, число страниц)
+    data = source.read()
+    digest = content_key(data)
+    key = content_key(data, "pages", digest=digest)
+    cached = image_cache.get(key)
+    if cached is not None:
+        return data, digest, int(cached)
+    count = count_pages(data)
+    image_cache.put(key, str(count).encode())
+    return data, digest, count
+
+
+def rasterize_page_cached(source, digest: str, page: int, width_inches: float, dpi: int = None,
+                          quality: int = None):
+    # в пуле, как normalize_source_cached: -> (байты, из_кеша, было_байт, ключ страницы).
+    # Размер исходника считаем один раз — на первой странице
+    data = source.read()
+    page_digest = content_key(data, "page", page, digest=digest)
+    key = content_key(data, target_width_px(width_inches, dpi), quality or JPEG_QUALITY, digest=page_digest)
+    result = image_cache.get(key)
+    cached = result is not None
+    if not cached:
+        result = rasterize_page(data, page, width_inches, dpi, quality)
+        image_cache.put(key, result)
+    return result, cached, len(data) if page == 0 else 0, page_digest
+
+
+def page_items(item, data: bytes, digest: str, count: int):
+    # вложение -> по записи на страницу; у каждой свой BytesSource над общими
+    # байтами, чтобы release_items одной страницы не отпускал остальные
+    return [
+        {
+            'name': item.get('name'),
+            'size': len(data),
+            'source': BytesSource(data),
+            'digest': digest,
+            'page': page,
+            'pages': min(count, MAX_PAGES),
+        }
+        for page in range(min(count, MAX_PAGES))
+    ]
@@ -0,0 +1,85 @@
+# -----------------------------
+# ПРОФИЛИРОВАНИЕ ОДНОГО РЕНДЕРА
+# -----------------------------
+# Включается переменной OCENKA_PROFILE=1 (все рендеры) или переключателем
+# администратора в сайдбаре (следующий рендер). Путь от загрузки шаблона до
+# сохранения DOCX выполняется под cProfile, профиль пишется рядом с отчётом:
+# Профиль_<договор>_<uuid>_<время>.prof — его можно открыть snakeviz или
+# `python -m pstats`. В интерфейсе показываются первые N функций по
+# накопленному времени.
+#
+# Когда профилирование выключено, модуль cProfile даже не импортируется.
+# До Python 3.12 cProfile видит только текущий поток; с 3.12 он построен на
+# sys.monitoring и собирает все потоки процесса, включая пул изображений
+# (и соседние рендеры). Там же активным может быть только один профилировщик
+# на процесс, поэтому одновременно профилируется один рендер: пока профиль
+# занят, остальные идут без него. Сбой профилировщика рендер не роняет.
+import io
+import os
+import threading
+import time
+from pathlib import Path
+
+from ocenka.output import safe_file_part
+
+PROFILE_ALWAYS = os.environ.get("OCENKA_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+PROFILE_TOP_N = int(os.environ.get("OCENKA_PROFILE_TOP", "30"))
+
+_profile_lock = threading.Lock()
+
+
+def profile_file_name(record) -> str:
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    contract = safe_file_part(record.get('Номер договора') or 'без_номера')
+    return f"Профиль_{contract}_{safe_file_part(record.get('user_uuid'))}_{stamp}.prof"
+
+
+class RenderProfile:
+    def __init__(self):
+        import cProfile
+
+        self._profile = cProfile.Profile()
+        self.path = None
+        self._running = False
+
+    def start(self):
+        self._profile.enable()
+        self._running = True
+        return self
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        try:
+            self._profile.disable()
+        except Exception as exc:
+            print("Не удалось остановить профилирование рендера:", exc)
+        finally:
+            _profile_lock.release()
+
+    def save(self, directory, record) -> Path:
+        self.path = Path(directory) / profile_file_name(record)
+        self._profile.dump_stats(str(self.path))
+        return self.path
+
+    def top(self, limit=PROFILE_TOP_N) -> str:
+        import pstats
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+def start_profile(enabled: bool):
+    # None, если профилирование не запрошено, профиль уже занят другим
+    # рендером или не запустился — вызывающий код просто проверяет
+    if not enabled or not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return RenderProfile().start()
+    except Exception as exc:
+        _profile_lock.release()
+        print("Не удалось запустить профилирование рендера:", exc)
+        return None
@@ -0,0 +1,384 @@
+# -----------------------------
+# ФОРМИРОВАНИЕ ОТЧЁТА ИЗ ШАБЛОНА
+# -----------------------------
+# Рендер без Streamlit: его вызывают и форма (main.py), и пакетная
+# генерация (python -m ocenka.cli).
+#
+# report — словарь с вложениями одного отчёта:
+#   record               — запись в том виде, что показывается в форме
+#   object_photos, appendix_1_files, appendix_2_files, rights_files
+#                        — списки {'name', 'data', 'size'}
+#   *_failures           — имена файлов, которые не удалось загрузить/обработать
+#   analogs              — список {'index', 'title', 'source', 'files', 'failures'}
+#
+# python-docx, docxtpl и lxml импортируются внутри функций: Streamlit
+# перезапускает main.py на каждое действие в форме, а документные библиотеки
+# нужны только при рендере. После первого импорта они остаются в sys.modules.
+import io
+import math
+import threading
+from pathlib import Path
+
+from ocenka.images import (
+    APPENDIX_WIDTH_INCHES,
+    APPENDIX_WIDTH_MM,
+    PHOTO_WIDTH_INCHES,
+    ImageStats,
+    normalize_batches,
+)
+from ocenka.metrics import NULL_TRACE
+from ocenka.output import dedupe_media, render_to_bytes, safe_file_part
+from ocenka.subdoc_cache import CachedSubdoc, SubdocEntry, subdoc_cache, subdoc_key
+from ocenka.uploads import BytesSource, release_items
+
+TEMPLATE_NAME = "mers_ocenka.docx"   # имя файла шаблона
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+TEMPLATE_PATH = TEMPLATES_DIR / TEMPLATE_NAME
+
+EMPTY_NAME = "без названия"
+ANALOG_EMPTY_TITLE = "без названия"
+ANALOG_TITLE_TEMPLATE = "Предложение по продаже транспортного средства (объект-аналог №{index})"
+
+# разделы записи с именами файлов и соответствующие им ключи report
+RECORD_FILE_SECTIONS = (
+    ("Фотографии объекта", "object_photos", "object_photo_failures"),
+    ("Приложение 1 (файлы)", "appendix_1_files", "appendix_1_failures"),
+    ("Приложение 2 (файлы)", "appendix_2_files", "appendix_2_failures"),
+    ("Подтверждение права (файлы)", "rights_files", "rights_failures"),
+)
+
+
+def default_analog_heading(index: int) -> str:
+    return ANALOG_TITLE_TEMPLATE.format(index=index)
+
+
+def report_file_name(record) -> str:
+    # имя и для скачивания, и для файлов пакетной генерации: «12/34» -> «12_34»
+    contract = safe_file_part(record.get('Номер договора') or 'без_номера')
+    return f"Отчёт_{contract}_{safe_file_part(record.get('user_uuid'))}.docx"
+
+
+def format_money(value) -> str:
+    return f"{float(value or 0):,.2f}".replace(",", " ")
+
+
+def build_photos_subdoc(doc, files, per_row=2, empty_message="Фотографии не загружены."):
+    from docx.enum.table import WD_TABLE_ALIGNMENT
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Inches
+
+    subdoc = doc.new_subdoc()
+    if not files:
+        if empty_message:
+            subdoc.add_paragraph(empty_message)
+        return subdoc
+    rows = math.ceil(len(files) / per_row)
+    table = subdoc.add_table(rows=rows, cols=per_row)
+    table.alignment = WD_TABLE_ALIGNMENT.CENTER
+    idx = 0
+    for r in range(rows):
+        for c in range(per_row):
+            cell = table.cell(r, c)
+            for paragraph in cell.paragraphs:
+                paragraph.text = ""
+            if idx < len(files):
+                image_stream = io.BytesIO(files[idx]['data'])
+                run = cell.paragraphs[0].add_run()
+                run.add_picture(image_stream, width=Inches(PHOTO_WIDTH_INCHES))
+                cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+                idx += 1
+    return subdoc
+
+
+def cached_photos_subdoc(doc, files, per_row=2, empty_message="Фотографии не загружены.", trace=NULL_TRACE):
+    # то же, что build_photos_subdoc, но таблица с теми же фото берётся из
+    # кеша (ocenka.subdoc_cache) — повторная отправка формы не вставляет
+    # картинки заново
+    if not files or not subdoc_cache.enabled:
+        return build_photos_subdoc(doc, files, per_row, empty_message)
+    key = subdoc_key(files, per_row, PHOTO_WIDTH_INCHES, empty_message)
+    entry = subdoc_cache.get(key)
+    if entry is not None:
+        trace.count("subdoc_hits")
+        return entry.materialize(doc)
+    trace.count("subdoc_misses")
+    xml = str(build_photos_subdoc(doc, files, per_row, empty_message))
+    subdoc_cache.put(key, SubdocEntry.capture(doc, xml))
+    return CachedSubdoc(xml)
+
+
+def summarize_attachments(files, failures):
+    lines = []
+    if files:
+        # страницы PDF/TIFF — одной строкой на файл
+        files = [item for item in files if not item.get('page')]
+        for idx, item in enumerate(files, start=1):
+            pages = item.get('pages', 1)
+            lines.append(f"{idx}. {item['name']}" + (f" ({pages} стр.)" if pages > 1 else ""))
+    if failures:
+        lines.append("Не удалось загрузить: " + ', '.join(failures))
+    if not lines:
+        return "Файлы не загружены."
+    return '\n'.join(lines)
+
+
+def build_appendix_entries(doc, files, failures):
+    from docxtpl import InlineImage
+    from docx.shared import Mm
+
+    entries = []
+
+    for item in files:
+        display_name = item.get('name', EMPTY_NAME)
+        try:
+            image_stream = io.BytesIO(item['data'])
+            image_stream.seek(0)
+            image_stream.name = display_name
+            img = InlineImage(doc, image_stream, width=Mm(APPENDIX_WIDTH_MM))
+        except Exception as exc:
+            failures.append(f"{display_name} (ошибка вставки: {exc})")
+            continue
+        entries.append({'image': img})
+
+    return entries
+
+
+def format_analog_source_text(text: str) -> str:
+    cleaned = (text or "").strip()
+    if not cleaned:
+        return ""
+    lower_cleaned = cleaned.lower()
+    prefix = "источник информации"
+    if lower_cleaned.startswith(prefix):
+        return cleaned
+    if not cleaned.startswith("(") and not cleaned.endswith(")"):
+        cleaned = f"({cleaned})"
+    return f"Источник информации: {cleaned}"
+
+
+def format_analog_source(text: str):
+    formatted = format_analog_source_text(text)
+    if not formatted:
+        return ""
+    from docxtpl import RichText
+    rt = RichText()
+    rt.add(formatted, italic=True)
+    return rt
+
+
+# -----------------------------
+# ПОДГОТОВКА И РЕНДЕР
+# -----------------------------
+def _files_bytes(files) -> int:
+    return sum(len(item.get('data') or b'') for item in files)
+
+
+def prepare_images(report, stats: ImageStats = None, trace=NULL_TRACE):
+    # уменьшаем и перекодируем фото под ширину, с которой они встанут в отчёт;
+    # все наборы обрабатываются параллельно в общем пуле, порядок сохраняется
+    if stats is None:
+        stats = ImageStats()
+    stage = trace.stage("images")
+    analogs = report['analogs']
+    analog_failure_marks = [len(item['failures']) for item in analogs]
+    (
+        report['object_photos'],
+        report['appendix_1_files'],
+        report['appendix_2_files'],
+        report['rights_files'],
+        *analog_files,
+    ) = normalize_batches(
+        [
+            (report['object_photos'], PHOTO_WIDTH_INCHES, report['object_photo_failures']),
+            (report['appendix_1_files'], APPENDIX_WIDTH_INCHES, report['appendix_1_failures']),
+            (report['appendix_2_files'], APPENDIX_WIDTH_INCHES, report['appendix_2_failures']),
+            (report['rights_files'], APPENDIX_WIDTH_INCHES, report['rights_failures']),
+        ]
+        + [(item['files'], PHOTO_WIDTH_INCHES, item['failures']) for item in analogs],
+        stats,
+    )
+    new_failures = []
+    for item, files, mark in zip(analogs, analog_files, analog_failure_marks):
+        item['files'] = files
+        for fail_name in item['failures'][mark:]:
+            new_failures.append(f"аналог №{item['index']}: {fail_name}")
+    stage.stop(bytes_in=stats.bytes_before, bytes_out=stats.bytes_after)
+    if stats.shared_bytes:
+        trace.count("media_saved_bytes", stats.shared_bytes)
+    return new_failures
+
+
+def build_context(doc, report, trace=NULL_TRACE):
+    record = report['record']
+    # переменные, которые есть в шаблоне (индекс строится при загрузке);
+    # подтаблицы фото и RichText собираем только для них. У обычного
+    # DocxTemplate индекса нет — тогда собираем всё
+    placeholders = getattr(doc, 'placeholders', None)
+
+    def used(name):
+        return placeholders is None or name in placeholders
+
+    # МАППИНГ ПОЛЕЙ -> МЕТКИ {{ ... }} В ШАБЛОНЕ
+    # (использую именно те ключи, которые ты перечислил)
+    context = {
+        # как ты указал: Основание -> {{ contract_number }} (да, дублируется)
+        "contract_number": record.get("Номер договора"),   # Номер контракта / и по твоей строке "Основание"
+        "date_ocenka": record.get("Дата оценки"),
+        "date_otcheta": record.get("Дата составления отчета"),
+        "customer_name": record.get("Заказчик"),
+
+        # нижний блок:
+        "contractor": record.get("Подрядчик"),
+        "otchet_number": record.get("Номер отчёта"),
+        "object_type": record.get("Название ТС"),
+        "car_name": record.get("Доп. наименование ТС"),
+        "vin_model": record.get("VIN"),
+        "cost_of_assessment": format_money(record.get("Стоимость без НДС")),
+        "cost_of_assessment_NDS": format_money(record.get("Стоимость с НДС")),
+    }
+    for key in ('appendix_1', 'appendix_2', 'rights'):
+        files = report[f'{key}_files']
+        failures = report[f'{key}_failures']
+        if used(f"{key}_entries"):
+            with trace.stage("appendix", bytes_in=_files_bytes(files)):
+                context[f"{key}_entries"] = build_appendix_entries(doc, files, failures)
+        context[f"{key}_summary"] = summarize_attachments(files, failures)
+    if used("object_ocenki"):
+        with trace.stage("photos", bytes_in=_files_bytes(report['object_photos'])):
+            context["object_ocenki"] = cached_photos_subdoc(
+                doc,
+                report['object_photos'],
+                empty_message="Фотографии объекта не загружены.",
+                trace=trace,
+            )
+    # блок аналога в шаблоне повторяется циклом {%p for analog in analogs %}:
+    # сколько аналогов, столько страниц, пустых слотов нет
+    if used("analogs"):
+        analogs = []
+        for analog_item in report['analogs']:
+            source = ""
+            if analog_item['files'] and analog_item['source']:
+                source = format_analog_source(analog_item['source'])
+            empty_msg = "Фотографии объекта-аналога не загружены." if not analog_item['files'] else ''
+            with trace.stage("photos", bytes_in=_files_bytes(analog_item['files'])):
+                photos = cached_photos_subdoc(doc, analog_item['files'], empty_message=empty_msg, trace=trace)
+            analogs.append({
+                'index': analog_item['index'],
+                'title': analog_item['title'],
+                'source': source,
+                'photos': photos,
+            })
+        context["analogs"] = analogs
+    return context
+
+
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def warm_up_async(template_path=TEMPLATE_PATH):
+    # Один раз на процесс в фоне подгружает docxtpl и разбирает шаблон,
+    # чтобы первый рендер не платил за импорт и разбор.
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+
+    def _warm_up():
+        try:
+            from ocenka.template_cache import template_cache
+            template_cache.warm(template_path)
+        except Exception as exc:
+            print("Не удалось прогреть шаблон:", exc)
+
+    threading.Thread(target=_warm_up, name="ocenka-warm-up", daemon=True).start()
+
+
+def render_document(report, template_path=TEMPLATE_PATH, trace=NULL_TRACE):
+    from ocenka.template_cache import get_template
+
+    # шаблон разбирается один раз на процесс, здесь — изолированная копия
+    with trace.stage("template"):
+        doc = get_template(template_path)
+    context = build_context(doc, report, trace)
+    with trace.stage("render"):
+        doc.render(context)
+    release_report(report)
+    return doc
+
+
+def serialize_document(doc, trace=NULL_TRACE) -> bytes:
+    stage = trace.stage("save")
+    parts, saved = dedupe_media(doc)
+    if parts:
+        trace.count("media_deduped", parts)
+        trace.count("media_saved_bytes", saved)
+    data = render_to_bytes(doc)
+    stage.stop(bytes_out=len(data))
+    return data
+
+
+def release_report(report):
+    # картинки уже в документе — отпускаем байты вложений, имена остаются
+    for _record_key, files_key, _failures_key in RECORD_FILE_SECTIONS:
+        release_items(report[files_key])
+    for item in report['analogs']:
+        release_items(item['files'])
+
+
+# -----------------------------
+# РЕНДЕР ПО ГОТОВОЙ ЗАПИСИ (без формы)
+# -----------------------------
+def _load_named_files(names, files, failures):
+    # байты не читаются: каталог отдаёт ленивый source, словарь — готовые байты
+    get_source = getattr(files, 'source', None)
+    loaded = []
+    for name in names or []:
+        try:
+            source = get_source(name) if get_source else BytesSource(files[name])
+            if not source.size:
+                raise ValueError('empty payload')
+        except Exception:
+            failures.append(name or EMPTY_NAME)
+        else:
+            loaded.append({'name': name or EMPTY_NAME, 'size': source.size, 'source': source})
+    return loaded
+
+
+def report_from_record(record, files):
+    # files — отображение «имя файла -> байты» (dict или ocenka.cli.DirectoryFiles)
+    report = {'record': record}
+    for record_key, files_key, failures_key in RECORD_FILE_SECTIONS:
+        failures = []
+        report[files_key] = _load_named_files(record.get(record_key), files, failures)
+        report[failures_key] = failures
+    analogs = []
+    for display_index, entry in enumerate(record.get("Объекты-аналоги") or [], start=1):
+        index = entry.get('Номер') or display_index
+        failures = list(entry.get('Ошибки') or [])
+        analogs.append({
+            'index': index,
+            'title': (entry.get('Название') or '').strip() or default_analog_heading(index),
+            'source': (entry.get('Источник') or '').strip(),
+            'files': _load_named_files(entry.get('Файлы'), files, failures),
+            'failures': failures,
+        })
+    report['analogs'] = analogs
+    return report
+
+
+def report_failures(report):
+    failures = []
+    for _record_key, _files_key, failures_key in RECORD_FILE_SECTIONS:
+        failures.extend(report[failures_key])
+    for item in report['analogs']:
+        failures.extend(f"аналог №{item['index']}: {name}" for name in item['failures'])
+    return failures
+
+
+def render_report(record, files, template_path=TEMPLATE_PATH, image_stats: ImageStats = None,
+                  trace=NULL_TRACE) -> bytes:
+    report = report_from_record(record, files)
+    prepare_images(report, image_stats, trace)
+    return serialize_document(render_document(report, template_path, trace), trace)
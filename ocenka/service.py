@@ -0,0 +1,363 @@
+# -----------------------------
+# СЕРВИС РЕНДЕРА ОТЧЁТОВ
+# -----------------------------
+# Пример: python -m ocenka.service --port 8765 --workers 4
+#         python -m ocenka.service --socket /run/ocenka/render.sock
+#
+# Отдельный процесс с пулом воркеров, в каждом шаблон уже разобран и
+# прогрет. Несколько реплик Streamlit отправляют сюда запись и файлы и
+# получают готовый DOCX, а тяжёлый рендер не конкурирует с перезапусками
+# интерфейса. В приложении включается переменной
+# OCENKA_RENDER_SERVICE=http://127.0.0.1:8765 (или unix:///путь/к/сокету).
+#
+# POST /render — тело application/octet-stream:
+#     4 байта (big-endian) — длина заголовка, JSON-заголовок
+#     {"record": {...}, "files": [[имя, размер], ...]}, затем байты файлов
+#     подряд. Файлы идут в том порядке, в котором на них ссылается запись
+#     (разделы RECORD_FILE_SECTIONS, затем аналоги), поэтому одинаковые
+#     имена в разных разделах не путаются.
+#     Ответ 200 — DOCX, список незагруженных файлов в заголовке
+#     X-Ocenka-Failures (JSON); 400 — битый запрос, 503 — очередь заполнена,
+#     500 — ошибка рендера ({"error": ...}).
+# GET /health — {"workers", "active", "rendered", "errors"}.
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from ocenka.metrics import RenderTrace
+from ocenka.render import (
+    RECORD_FILE_SECTIONS,
+    TEMPLATE_PATH,
+    prepare_images,
+    render_document,
+    report_failures,
+    report_from_record,
+    serialize_document,
+)
+from ocenka.uploads import BytesSource, item_bytes
+
+RENDER_SERVICE_URL = os.environ.get("OCENKA_RENDER_SERVICE", "").strip()
+SERVICE_TIMEOUT = float(os.environ.get("OCENKA_RENDER_SERVICE_TIMEOUT", "300"))
+# сколько запросов одновременно принимать (в работе + ожидают воркера)
+SERVICE_QUEUE = int(os.environ.get("OCENKA_RENDER_SERVICE_QUEUE", "64"))
+
+_HEADER = struct.Struct(">I")
+
+
+class RenderServiceError(RuntimeError):
+    pass
+
+
+# -----------------------------
+# ФОРМАТ ЗАПРОСА
+# -----------------------------
+def pack_request(record, files) -> bytes:
+    # files — список (имя, байты) в порядке ссылок из записи
+    header = json.dumps(
+        {"record": record, "files": [[name, len(data)] for name, data in files]},
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return b"".join([_HEADER.pack(len(header)), header, *(data for _name, data in files)])
+
+
+def unpack_request(body: bytes):
+    view = memoryview(body)
+    (header_len,) = _HEADER.unpack_from(view)
+    offset = _HEADER.size + header_len
+    header = json.loads(bytes(view[_HEADER.size:offset]).decode("utf-8"))
+    files = []
+    for name, size in header["files"]:
+        if offset + size > len(body):
+            raise ValueError("обрезанное тело запроса")
+        files.append((name, bytes(view[offset:offset + size])))
+        offset += size
+    return header["record"], files
+
+
+def report_files(report):
+    # файлы отчёта в порядке ссылок из записи — для pack_request
+    items = [item for _key, files_key, _fail in RECORD_FILE_SECTIONS for item in report[files_key]]
+    items += [item for analog in report['analogs'] for item in analog['files']]
+    return [(item['name'], item_bytes(item)) for item in items]
+
+
+class PackedFiles(Mapping):
+    # «имя файла -> байты» для report_from_record: одинаковые имена
+    # выдаются по очереди, в том порядке, в каком пришли
+    def __init__(self, files):
+        self._queues = defaultdict(deque)
+        for name, data in files:
+            self._queues[name].append(data)
+
+    def source(self, name):
+        return BytesSource(self[name])
+
+    def __getitem__(self, name):
+        queue = self._queues.get(name)
+        if not queue:
+            raise KeyError(name)
+        return queue.popleft()
+
+    def __iter__(self):
+        return iter(self._queues)
+
+    def __len__(self):
+        return len(self._queues)
+
+
+# -----------------------------
+# КЛИЕНТ
+# -----------------------------
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class RenderClient:
+    def __init__(self, url=RENDER_SERVICE_URL, timeout=SERVICE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        parts = urlsplit(url)
+        if parts.scheme == "unix":
+            self._connect = lambda: _UnixHTTPConnection(parts.path, timeout)
+        elif parts.scheme == "http":
+            self._connect = lambda: http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        else:
+            raise ValueError(f"неподдерживаемый адрес сервиса рендера: {url}")
+
+    def _request(self, method, path, body=None, headers=None):
+        conn = self._connect()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.getheader("X-Ocenka-Failures"), response.read()
+        except OSError as exc:
+            raise RenderServiceError(f"сервис рендера недоступен ({self.url}): {exc}") from exc
+        finally:
+            conn.close()
+
+    def render(self, record, files):
+        # -> (байты DOCX, список незагруженных файлов)
+        status, failures, body = self._request(
+            "POST", "/render", pack_request(record, files), {"Content-Type": "application/octet-stream"}
+        )
+        if status != 200:
+            try:
+                message = json.loads(body)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = body[:200].decode("utf-8", "replace")
+            raise RenderServiceError(f"сервис рендера вернул {status}: {message}")
+        return body, json.loads(failures or "[]")
+
+    def health(self) -> dict:
+        status, _failures, body = self._request("GET", "/health")
+        if status != 200:
+            raise RenderServiceError(f"сервис рендера вернул {status}")
+        return json.loads(body)
+
+
+# -----------------------------
+# ВОРКЕРЫ
+# -----------------------------
+def _init_worker(template_path):
+    from ocenka import images
+    from ocenka.template_cache import template_cache
+
+    # параллелизм — на уровне запросов, внутри воркера картинки идут по одной
+    images.IMAGE_WORKERS = 1
+    template_cache.warm(template_path)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render(record, files, template_path):
+    trace = RenderTrace(source="service", user_uuid=record.get("user_uuid"), contract=record.get("Номер договора"))
+    try:
+        with trace.stage("ingest"):
+            report = report_from_record(record, PackedFiles(files))
+        prepare_images(report, trace=trace)
+        data = serialize_document(render_document(report, template_path, trace), trace)
+    except Exception as exc:
+        trace.write(error=f"{exc.__class__.__name__}: {exc}")
+        raise
+    trace.write()
+    return data, report_failures(report)
+
+
+class RenderService:
+    def __init__(self, workers, template_path=TEMPLATE_PATH, queue=SERVICE_QUEUE):
+        self.workers = max(1, workers)
+        self.template_path = str(template_path)
+        self._slots = threading.BoundedSemaphore(max(1, queue))
+        self._pool_lock = threading.Lock()
+        self._pool = None
+        self._count_lock = threading.Lock()
+        self.active = 0
+        self.rendered = 0
+        self.errors = 0
+
+    def start(self):
+        # воркеры поднимаются и прогревают шаблон до приёма запросов
+        with self._pool_lock:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.template_path,)
+            )
+            pool = self._pool
+        for future in [pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def render(self, record, files):
+        if not self._slots.acquire(blocking=False):
+            return None
+        self._count(active=1)
+        try:
+            with self._pool_lock:
+                pool = self._pool
+            try:
+                result = pool.submit(_render, record, files, self.template_path).result(timeout=SERVICE_TIMEOUT)
+            except BrokenProcessPool:
+                # воркер упал (например, нехватка памяти) — пересоздаём пул
+                with self._pool_lock:
+                    if self._pool is pool:
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers, initializer=_init_worker, initargs=(self.template_path,)
+                        )
+                raise
+            self._count(rendered=1)
+            return result
+        except Exception:
+            self._count(errors=1)
+            raise
+        finally:
+            self._count(active=-1)
+            self._slots.release()
+
+    def _count(self, active=0, rendered=0, errors=0):
+        with self._count_lock:
+            self.active += active
+            self.rendered += rendered
+            self.errors += errors
+
+    def health(self) -> dict:
+        return {"workers": self.workers, "active": self.active, "rendered": self.rendered, "errors": self.errors}
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    service: RenderService = None
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status, body: bytes, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, status, payload):
+        self._reply(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._reply_json(404, {"error": "not found"})
+            return
+        self._reply_json(200, self.service.health())
+
+    def do_POST(self):
+        if self.path != "/render":
+            self._reply_json(404, {"error": "not found"})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            record, files = unpack_request(body)
+        except (ValueError, KeyError, TypeError, struct.error) as exc:
+            self._reply_json(400, {"error": f"некорректный запрос: {exc}"})
+            return
+        try:
+            result = self.service.render(record, files)
+        except Exception as exc:
+            self._reply_json(500, {"error": f"{exc.__class__.__name__}: {exc}"})
+            return
+        if result is None:
+            self._reply_json(503, {"error": "очередь сервиса рендера заполнена"})
+            return
+        data, failures = result
+        self._reply(
+            200,
+            data,
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            {"X-Ocenka-Failures": json.dumps(failures)},
+        )
+
+    def address_string(self):
+        # у unix-сокета нет адреса клиента
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис рендера отчётов об оценке.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="путь к unix-сокету вместо TCP")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов-воркеров")
+    parser.add_argument("--template", default=str(TEMPLATE_PATH), help="путь к шаблону DOCX")
+    args = parser.parse_args(argv)
+
+    service = RenderService(args.workers, args.template)
+    service.start()
+    handler = type("Handler", (RenderRequestHandler,), {"service": service})
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, handler)
+        address = f"unix://{args.socket}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        address = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Сервис рендера: {address}, воркеров: {service.workers}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# -----------------------------
+# ХРАНИЛИЩЕ ОЦЕНОК (SQLite)
+# -----------------------------
+# Пример: python -m ocenka.store --vin WDB1234567890
+#
+# Каждая отправленная форма сохраняется: запись целиком (JSON), основные
+# поля отдельными колонками, список вложений и имя файла отчёта. База —
+# SQLite в режиме WAL (OCENKA_DB_PATH, по умолчанию data/appraisals.sqlite3).
+#
+# Пишет один фоновый поток со своим соединением: save_async() только кладёт
+# запись в очередь и не ждёт диска, подряд пришедшие записи сохраняются одной
+# транзакцией. Чтение идёт через отдельные соединения на поток и писателя
+# не блокирует. Индексы по номеру договора, VIN, госномеру, user_uuid и дате
+# отчёта (вместе с датой — чтобы «все отчёты по VIN» сразу шли по порядку).
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from pathlib import Path
+
+from ocenka.render import RECORD_FILE_SECTIONS
+
+DB_PATH = Path(
+    os.environ.get("OCENKA_DB_PATH") or Path(__file__).resolve().parent.parent / "data" / "appraisals.sqlite3"
+)
+# сколько записей из очереди писать одной транзакцией
+WRITE_BATCH = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appraisals (
+    id             INTEGER PRIMARY KEY,
+    created_at     TEXT NOT NULL,
+    user_uuid      TEXT,
+    user_name      TEXT,
+    user_login     TEXT,
+    contract_no    TEXT,
+    basis          TEXT,
+    valuation_date TEXT,
+    report_date    TEXT,
+    customer       TEXT,
+    contractor     TEXT,
+    price_vat      REAL,
+    price_no_vat   REAL,
+    otchet_number  TEXT,
+    object_type    TEXT,
+    car_name       TEXT,
+    car_number     TEXT,
+    vin            TEXT,
+    file_name      TEXT,
+    report_id      TEXT,
+    record_json    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    id           INTEGER PRIMARY KEY,
+    appraisal_id INTEGER NOT NULL REFERENCES appraisals(id) ON DELETE CASCADE,
+    section      TEXT NOT NULL,
+    analog_index INTEGER,
+    name         TEXT NOT NULL,
+    size         INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_appraisals_contract ON appraisals(contract_no, report_date);
+CREATE INDEX IF NOT EXISTS ix_appraisals_vin ON appraisals(vin, report_date);
+CREATE INDEX IF NOT EXISTS ix_appraisals_car_number ON appraisals(car_number, report_date);
+CREATE INDEX IF NOT EXISTS ix_appraisals_user ON appraisals(user_uuid, report_date);
+CREATE INDEX IF NOT EXISTS ix_appraisals_report_date ON appraisals(report_date);
+CREATE INDEX IF NOT EXISTS ix_attachments_appraisal ON attachments(appraisal_id);
+CREATE INDEX IF NOT EXISTS ix_appraisals_report_id ON appraisals(report_id);
+"""
+# колонки, добавленные после первой версии схемы: (имя, тип)
+MIGRATIONS = (
+    ("report_id", "TEXT"),
+)
+
+_INSERT_APPRAISAL = """
+INSERT INTO appraisals (
+    created_at, user_uuid, user_name, user_login,
+    contract_no, basis, valuation_date, report_date,
+    customer, contractor, price_vat, price_no_vat,
+    otchet_number, object_type, car_name, car_number, vin, file_name, report_id, record_json
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_INSERT_ATTACHMENT = "INSERT INTO attachments (appraisal_id, section, analog_index, name, size) VALUES (?, ?, ?, ?, ?)"
+
+# поиск только по проиндексированным колонкам
+LOOKUP_COLUMNS = ("contract_no", "vin", "car_number", "user_uuid")
+
+
+def normalize_key(value) -> str:
+    # VIN и госномер вводятся как попало: пробелы и регистр не различаем
+    return "".join(str(value or "").split()).upper() or None
+
+
+def _iso_date(value):
+    # в записи даты вида 31.12.2024; в базе — 2024-12-31, чтобы сортировать
+    try:
+        return datetime.strptime(str(value), "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return str(value) if value else None
+
+
+def attachments_from_report(report):
+    # [(раздел, номер аналога, имя, размер)] — пока вложения ещё в отчёте
+    rows = []
+    for record_key, files_key, _failures_key in RECORD_FILE_SECTIONS:
+        rows.extend((record_key, None, item['name'], item.get('size')) for item in report[files_key])
+    for analog in report['analogs']:
+        rows.extend(("Объекты-аналоги", analog['index'], item['name'], item.get('size')) for item in analog['files'])
+    return rows
+
+
+def _attachments_from_record(record):
+    rows = []
+    for record_key, _files_key, _failures_key in RECORD_FILE_SECTIONS:
+        rows.extend((record_key, None, name, None) for name in record.get(record_key) or [])
+    for entry in record.get("Объекты-аналоги") or []:
+        rows.extend(("Объекты-аналоги", entry.get("Номер"), name, None) for name in entry.get("Файлы") or [])
+    return rows
+
+
+def _appraisal_row(record, file_name, report_id):
+    return (
+        datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        record.get("user_uuid"),
+        record.get("user_name"),
+        record.get("user_login"),
+        record.get("Номер договора") or None,
+        record.get("Основание"),
+        _iso_date(record.get("Дата оценки")),
+        _iso_date(record.get("Дата составления отчета")),
+        record.get("Заказчик"),
+        record.get("Подрядчик"),
+        record.get("Стоимость с НДС"),
+        record.get("Стоимость без НДС"),
+        record.get("Номер отчёта"),
+        record.get("Название ТС"),
+        record.get("Доп. наименование ТС"),
+        normalize_key(record.get("Регистрационный номер автомобиля")),
+        normalize_key(record.get("VIN")),
+        file_name,
+        report_id,
+        json.dumps(record, ensure_ascii=False, default=str),
+    )
+
+
+def connect(path=None) -> sqlite3.Connection:
+    path = Path(path or DB_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _migrate(conn):
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(appraisals)")}
+    if not columns:
+        return
+    for name, kind in MIGRATIONS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE appraisals ADD COLUMN {name} {kind}")
+
+
+class AppraisalStore:
+    def __init__(self, path=None):
+        self.path = Path(path or DB_PATH)
+        self._queue = queue.Queue()
+        self._writer = None
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+
+    # ---- запись ----
+    def _ensure_writer(self):
+        with self._start_lock:
+            if self._writer is None or not self._writer.is_alive():
+                conn = connect(self.path)
+                _migrate(conn)
+                conn.executescript(SCHEMA)
+                self._schema_ready = True
+                self._writer = threading.Thread(target=self._write_loop, args=(conn,), name="appraisal-store", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self, conn):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    # запись без record — метка flush(), в базу не идёт
+                    ids = [self._insert(conn, *item[:4]) if item[0] is not None else None for item in batch]
+            except Exception:
+                # пакет откатился целиком — пишем по одной, чтобы одна битая
+                # запись не потеряла соседние
+                for item in batch:
+                    try:
+                        with conn:
+                            appraisal_id = self._insert(conn, *item[:4]) if item[0] is not None else None
+                    except Exception as exc:
+                        print("Не удалось сохранить оценку в базу:", exc)
+                        item[4].set_exception(exc)
+                    else:
+                        item[4].set_result(appraisal_id)
+            else:
+                for item, appraisal_id in zip(batch, ids):
+                    item[4].set_result(appraisal_id)
+
+    @staticmethod
+    def _insert(conn, record, file_name, attachments, report_id):
+        cur = conn.execute(_INSERT_APPRAISAL, _appraisal_row(record, file_name, report_id))
+        appraisal_id = cur.lastrowid
+        conn.executemany(
+            _INSERT_ATTACHMENT,
+            [(appraisal_id, section, analog_index, name, size) for section, analog_index, name, size in attachments],
+        )
+        return appraisal_id
+
+    def save_async(self, record, file_name=None, attachments=None, report_id=None) -> Future:
+        # -> Future с id записи; вызывающий поток не ждёт диска
+        self._ensure_writer()
+        if attachments is None:
+            attachments = _attachments_from_record(record)
+        future = Future()
+        self._queue.put((record, file_name, list(attachments), report_id, future))
+        return future
+
+    def save(self, record, file_name=None, attachments=None, report_id=None) -> int:
+        return self.save_async(record, file_name, attachments, report_id).result()
+
+    # ---- чтение ----
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._schema_ready:
+                self._ensure_writer()
+            conn = self._local.conn = connect(self.path)
+        return conn
+
+    def find(self, limit=100, **filters):
+        # find(vin="...") / find(contract_no="...", limit=20): новые отчёты первыми
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column not in LOOKUP_COLUMNS:
+                raise ValueError(f"поиск по {column} не поддерживается")
+            if column in ("vin", "car_number"):
+                value = normalize_key(value)
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT id, created_at, user_uuid, user_login, contract_no, report_date, vin, car_number, "
+            f"object_type, file_name, report_id FROM appraisals {where} ORDER BY report_date DESC, id DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, appraisal_id):
+        conn = self._reader()
+        row = conn.execute("SELECT * FROM appraisals WHERE id = ?", (appraisal_id,)).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["record"] = json.loads(result.pop("record_json"))
+        result["attachments"] = [
+            dict(item)
+            for item in conn.execute(
+                "SELECT section, analog_index, name, size FROM attachments WHERE appraisal_id = ? ORDER BY id",
+                (appraisal_id,),
+            )
+        ]
+        return result
+
+    def flush(self, timeout=None):
+        # дождаться записи всего, что уже в очереди
+        self._ensure_writer()
+        future = Future()
+        self._queue.put((None, None, None, None, future))
+        future.result(timeout)
+
+
+appraisal_store = AppraisalStore()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Поиск оценок в локальной базе.")
+    parser.add_argument("--vin")
+    parser.add_argument("--contract", dest="contract_no")
+    parser.add_argument("--car-number")
+    parser.add_argument("--user-uuid")
+    parser.add_argument("--id", type=int, help="показать запись целиком")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--db", help="путь к базе (по умолчанию OCENKA_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    store = AppraisalStore(args.db) if args.db else appraisal_store
+    if args.id is not None:
+        print(json.dumps(store.get(args.id), ensure_ascii=False, indent=2))
+        return 0
+    filters = {column: getattr(args, column) for column in LOOKUP_COLUMNS if getattr(args, column)}
+    for row in store.find(limit=args.limit, **filters):
+        print(
+            f"{row['id']:>8}  {row['report_date'] or '-':<10}  {row['contract_no'] or '-':<16}  "
+            f"{row['vin'] or '-':<18}  {row['car_number'] or '-':<10}  {row['file_name'] or ''}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# -----------------------------
+# КЕШ ТАБЛИЦ ФОТО (SUBDOC)
+# -----------------------------
+# Повторная отправка формы с теми же фотографиями (поменяли только номер
+# договора) не собирает таблицы фото заново. Ключ — SHA-256 уже
+# обработанных изображений по порядку + число колонок + ширина фото +
+# текст-заглушка; значение — XML таблицы и байты картинок. На попадании
+# картинки добавляются в пакет нового документа тем же вызовом, что и при
+# add_picture, а в XML подставляются выданные им rId — результат совпадает
+# с обычной сборкой байт в байт.
+#
+# Кеш живёт в памяти процесса и общий для всех сессий: ключ — содержимое
+# фото, а не имена файлов. Вытеснение LRU по суммарному размеру
+# (OCENKA_SUBDOC_CACHE_MB, 0 — выключен). Попадания и промахи каждого
+# рендера пишутся в журнал замеров (counters.subdoc_hits/subdoc_misses).
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+
+SUBDOC_CACHE_MAX_MB = int(os.environ.get("OCENKA_SUBDOC_CACHE_MB", "64"))
+
+EMBED_PATTERN = re.compile(r'(r:embed=")(rId\d+)(")')
+
+
+def subdoc_key(files, *params) -> str:
+    digest = hashlib.sha256()
+    for item in files:
+        digest.update(hashlib.sha256(item['data']).digest())
+    return digest.hexdigest() + "_" + "_".join(str(p) for p in params)
+
+
+class CachedSubdoc:
+    # готовый XML для подстановки в шаблон; docxtpl берёт его через str(),
+    # как и у docxtpl.Subdoc
+    def __init__(self, xml: str):
+        self.xml = xml
+
+    def __str__(self):
+        return self.xml
+
+    def __html__(self):
+        return self.xml
+
+
+class SubdocEntry:
+    def __init__(self, segments, slots, images):
+        # segments[i] + rId(slots[i]) + segments[i + 1] ...
+        self.segments = segments
+        self.slots = slots
+        self.images = images
+        self.size = sum(len(s) for s in segments) + sum(len(b) for b in images)
+
+    @classmethod
+    def capture(cls, doc, xml: str):
+        # rId в XML -> байты картинки из пакета документа
+        part = doc.get_docx().part
+        segments, slots, images, seen = [], [], [], {}
+        pos = 0
+        for match in EMBED_PATTERN.finditer(xml):
+            rid = match.group(2)
+            if rid not in seen:
+                seen[rid] = len(images)
+                images.append(part.related_parts[rid].blob)
+            segments.append(xml[pos:match.end(1)])
+            slots.append(seen[rid])
+            pos = match.start(3)
+        segments.append(xml[pos:])
+        return cls(segments, slots, images)
+
+    def materialize(self, doc) -> CachedSubdoc:
+        part = doc.get_docx().part
+        rids = [part.get_or_add_image(io.BytesIO(blob))[0] for blob in self.images]
+        pieces = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            pieces.append(rids[slot])
+            pieces.append(segment)
+        return CachedSubdoc("".join(pieces))
+
+
+class SubdocCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: SubdocEntry):
+        if not self.enabled or entry.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old.size
+            self._entries[key] = entry
+            self._total += entry.size
+            while self._total > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self._total -= evicted.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._total}
+
+
+subdoc_cache = SubdocCache(SUBDOC_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,172 @@
+# -----------------------------
+# КЕШ РАЗОБРАННЫХ ШАБЛОНОВ DOCX
+# -----------------------------
+# Шаблон разбирается один раз на процесс: читаем файл, строим Document,
+# подготавливаем XML тела (patch_xml) и компилируем Jinja-шаблоны.
+# Каждый рендер получает собственную глубокую копию документа, поэтому
+# параллельные сессии Streamlit не делят изменяемое состояние.
+#
+# Там же строится индекс плейсхолдеров: какие переменные шаблон использует
+# и в какой части документа (body / header / footer). По нему контекст
+# рендера собирает только то, что действительно попадёт в документ.
+import copy
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from docx import Document
+from docx.oxml import parse_xml
+from docxtpl import DocxTemplate
+from jinja2 import Environment, meta
+
+# сколько скомпилированных частей (тело, колонтитулы, свойства) держать в env
+COMPILED_PARTS_LIMIT = 64
+
+
+class CompiledTemplateEnvironment(Environment):
+    # from_string с кешем: docxtpl компилирует каждую часть документа заново,
+    # а исходный XML у нетронутой копии шаблона всегда один и тот же.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compiled = OrderedDict()
+        self._compiled_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class is not None or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        with self._compiled_lock:
+            template = self._compiled.get(source)
+            if template is not None:
+                self._compiled.move_to_end(source)
+                return template
+        template = super().from_string(source)
+        with self._compiled_lock:
+            self._compiled[source] = template
+            while len(self._compiled) > COMPILED_PARTS_LIMIT:
+                self._compiled.popitem(last=False)
+        return template
+
+
+class TemplateEntry:
+    def __init__(self, path: Path, key, blob: bytes):
+        self.path = path
+        self.key = key
+        self.sha256 = hashlib.sha256(blob).hexdigest()
+        self.document = Document(io.BytesIO(blob))
+        self.jinja_env = CompiledTemplateEnvironment()
+        self._patched = {}
+        self._patched_lock = threading.Lock()
+        self._placeholders = None
+        self._placeholders_lock = threading.Lock()
+
+    def patch_xml(self, src_xml, patcher):
+        with self._patched_lock:
+            patched = self._patched.get(src_xml)
+        if patched is None:
+            patched = patcher(src_xml)
+            with self._patched_lock:
+                self._patched[src_xml] = patched
+        return patched
+
+    def placeholders(self, tpl) -> dict:
+        # {имя переменной: {'body', 'header', 'footer'}} — один раз на шаблон
+        with self._placeholders_lock:
+            if self._placeholders is None:
+                parts = [("body", tpl.xml_to_string(self.document._element.body))]
+                for rel in self.document.part.rels.values():
+                    kind = {tpl.HEADER_URI: "header", tpl.FOOTER_URI: "footer"}.get(rel.reltype)
+                    if kind and not rel.is_external and rel.target_part.blob:
+                        parts.append((kind, tpl.xml_to_string(parse_xml(rel.target_part.blob))))
+                index = {}
+                for kind, xml in parts:
+                    ast = self.jinja_env.parse(tpl.patch_xml(xml))
+                    for name in meta.find_undeclared_variables(ast):
+                        index.setdefault(name, set()).add(kind)
+                self._placeholders = index
+            return self._placeholders
+
+
+class CachedDocxTemplate(DocxTemplate):
+    # DocxTemplate поверх записи кеша: документ — изолированная копия,
+    # patch_xml и компиляция Jinja берутся из общей записи.
+    def __init__(self, entry: TemplateEntry):
+        super().__init__(str(entry.path))
+        self._entry = entry
+        self.docx = copy.deepcopy(entry.document)
+
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = copy.deepcopy(self._entry.document)
+            self.is_rendered = False
+
+    def patch_xml(self, src_xml):
+        return self._entry.patch_xml(src_xml, super().patch_xml)
+
+    @property
+    def placeholders(self) -> dict:
+        return self._entry.placeholders(self)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        # при autoescape docxtpl меняет переданный env — общий env не отдаём
+        if jinja_env is None and not autoescape:
+            jinja_env = self._entry.jinja_env
+        super().render(context, jinja_env=jinja_env, autoescape=autoescape)
+
+
+class TemplateCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load_entry(self, path: Path) -> TemplateEntry:
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == key:
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # разбор файла — вне блокировки, чтобы не держать другие сессии
+        entry = TemplateEntry(path, key, path.read_bytes())
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    def warm(self, path):
+        # Разобрать шаблон заранее и прогнать пустой рендер: так patch_xml и
+        # компиляция Jinja попадают в кеш до первого настоящего отчёта.
+        path = Path(path).resolve()
+        if path.exists():
+            tpl = CachedDocxTemplate(self._load_entry(path))
+            tpl.placeholders
+            tpl.render({})
+
+    def get(self, path) -> CachedDocxTemplate:
+        path = Path(path).resolve()
+        return CachedDocxTemplate(self._load_entry(path))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "templates": len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+template_cache = TemplateCache()
+
+
+def get_template(path) -> CachedDocxTemplate:
+    return template_cache.get(path)
@@ -0,0 +1,161 @@
+# -----------------------------
+# ПРЕВЬЮ ЗАГРУЖЕННЫХ ФАЙЛОВ
+# -----------------------------
+# Под каждым загрузчиком формы показываются миниатюры: так видно, что
+# загружено, без открытия DOCX, а в браузер уходят килобайтные картинки
+# вместо исходных фото с телефона.
+#
+# Миниатюра строится один раз на содержимое (SHA-256) в общем пуле
+# обработки изображений и хранится в памяти процесса; вытеснение LRU по
+# суммарному размеру (OCENKA_THUMB_CACHE_MB). SHA-256 загрузки
+# запоминается по file_id — на повторных перезапусках байты не хешируются.
+# Скрипт миниатюры не ждёт: неготовые показываются заглушкой, а блок превью
+# в main.py перезапускается по таймеру, пока они строятся (pending()).
+#
+# Файл, миниатюра которого уже строилась, в пул повторно не ставится.
+# Миниатюра, не попавшая в кеш (OCENKA_THUMB_CACHE_MB=0 или сразу
+# вытеснена), держится в слоте по file_id (последние UNCACHED_MEMO);
+# вытесненная позже показывается просто именем файла.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from ocenka.images import get_image_pool, is_image_file, normalize_image
+
+THUMB_PX = int(os.environ.get("OCENKA_THUMB_PX", "160"))
+THUMB_CACHE_MB = int(os.environ.get("OCENKA_THUMB_CACHE_MB", "32"))
+THUMB_QUALITY = 70
+# сколько file_id -> sha256 помнить
+DIGEST_MEMO = 4096
+# сколько миниатюр мимо кеша держать по file_id
+UNCACHED_MEMO = 256
+
+# миниатюру построить не удалось (битый файл) — кешируем и это
+NO_PREVIEW = b""
+
+
+def make_thumbnail(data: bytes):
+    # -> (sha256 исходника, байты миниатюры или NO_PREVIEW). Та же картинка,
+    # загруженная повторно, берётся из кеша (в пуле потоков он общий с формой)
+    digest = hashlib.sha256(data).hexdigest()
+    thumb = thumbnail_cache.get(digest)
+    if thumb is None:
+        try:
+            thumb = normalize_image(data, 1.0, dpi=THUMB_PX, quality=THUMB_QUALITY)
+        except Exception:
+            thumb = NO_PREVIEW
+    return digest, thumb
+
+
+class ThumbnailCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._thumbs = OrderedDict()    # sha256 -> байты миниатюры
+        self._digests = OrderedDict()   # file_id -> sha256 (None — построить не удалось)
+        self._uncached = OrderedDict()  # file_id -> миниатюра, не попавшая в кеш
+        self._pending = {}              # file_id -> Future
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            thumb = self._thumbs.get(digest)
+            if thumb is not None:
+                self._thumbs.move_to_end(digest)
+            return thumb
+
+    def _lookup(self, file_id):
+        # под self._lock: None — миниатюра ещё не строилась
+        if file_id not in self._digests:
+            return None
+        self._digests.move_to_end(file_id)
+        digest = self._digests[file_id]
+        thumb = self._thumbs.get(digest)
+        if thumb is not None:
+            self._thumbs.move_to_end(digest)
+            return thumb
+        thumb = self._uncached.get(file_id)
+        if thumb is not None:
+            self._uncached.move_to_end(file_id)
+            return thumb
+        # строилась, но из кеша уже вытеснена — заново не строим
+        return NO_PREVIEW
+
+    def _store(self, file_id, digest, thumb):
+        # под self._lock
+        self._digests[file_id] = digest
+        while len(self._digests) > DIGEST_MEMO:
+            self._digests.popitem(last=False)
+        if digest in self._thumbs:
+            return
+        if self.max_bytes > 0:
+            self._thumbs[digest] = thumb
+            self._total += len(thumb)
+            while self._total > self.max_bytes and self._thumbs:
+                _digest, evicted = self._thumbs.popitem(last=False)
+                self._total -= len(evicted)
+        if digest not in self._thumbs:
+            self._uncached[file_id] = thumb
+            while len(self._uncached) > UNCACHED_MEMO:
+                self._uncached.popitem(last=False)
+
+    def _collect(self):
+        # под self._lock: забрать готовые результаты из пула
+        for file_id, future in list(self._pending.items()):
+            if not future.done():
+                continue
+            del self._pending[file_id]
+            try:
+                digest, thumb = future.result()
+            except Exception:
+                # не читается — показываем имя, повторно не пробуем
+                self._digests[file_id] = None
+                continue
+            self._store(file_id, digest, thumb)
+
+    def request(self, uploaded_files):
+        # поставить недостающие миниатюры в пул, не дожидаясь
+        with self._lock:
+            self._collect()
+            for uploaded in uploaded_files:
+                if not is_image_file(uploaded.name):
+                    continue
+                file_id = _file_id(uploaded)
+                if file_id not in self._digests and file_id not in self._pending:
+                    self._pending[file_id] = get_image_pool().submit(make_thumbnail, uploaded.getvalue())
+
+    def previews(self, uploaded_files):
+        # -> [(имя, миниатюра | NO_PREVIEW | None — ещё строится)] в порядке
+        # загрузки; сразу, без ожидания пула
+        self.request(uploaded_files)
+        result = []
+        with self._lock:
+            self._collect()
+            for uploaded in uploaded_files:
+                if is_image_file(uploaded.name):
+                    result.append((uploaded.name, self._lookup(_file_id(uploaded))))
+                else:
+                    result.append((uploaded.name, NO_PREVIEW))
+        return result
+
+    def pending(self, uploaded_files=None) -> bool:
+        # строится ли ещё хоть одна миниатюра (из uploaded_files или вообще)
+        with self._lock:
+            if uploaded_files is None:
+                futures = list(self._pending.values())
+            else:
+                futures = [self._pending.get(_file_id(uploaded)) for uploaded in uploaded_files]
+            return any(future is not None and not future.done() for future in futures)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"thumbs": len(self._thumbs), "bytes": self._total, "pending": len(self._pending)}
+
+
+def _file_id(uploaded):
+    # у st.file_uploader у каждой загрузки свой file_id; иначе — имя и размер
+    return getattr(uploaded, "file_id", None) or (uploaded.name, uploaded.size)
+
+
+thumbnail_cache = ThumbnailCache(THUMB_CACHE_MB * 1024 * 1024)
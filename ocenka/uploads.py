@@ -0,0 +1,78 @@
+# -----------------------------
+# ПРИЁМ ЗАГРУЖЕННЫХ ФАЙЛОВ БЕЗ ЛИШНИХ КОПИЙ В ПАМЯТИ
+# -----------------------------
+# Вложение отчёта — словарь {'name', 'size', 'source'}: байты не читаются
+# заранее, source.read() вызывается в пуле обработки изображений прямо
+# перед декодированием. После обработки в записи остаётся только
+# уменьшенная картинка ('data'), исходник отпускается.
+#
+#   UploadSource — файл из st.file_uploader (читается без копирования)
+#   PathSource   — файл на диске (пакетная генерация)
+#   BytesSource  — уже прочитанные байты
+import os
+
+
+class UploadSource:
+    def __init__(self, uploaded_file):
+        self._file = uploaded_file
+        self.size = uploaded_file.size if hasattr(uploaded_file, "size") else len(uploaded_file.getvalue())
+
+    def read(self) -> bytes:
+        # UploadedFile — это BytesIO: getvalue() отдаёт его буфер без копии
+        return self._file.getvalue()
+
+    def close(self):
+        self._file = None
+
+
+class PathSource:
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.size = os.path.getsize(self.path)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+
+class BytesSource:
+    def __init__(self, data: bytes):
+        self._data = data
+        self.size = len(data)
+
+    def read(self) -> bytes:
+        return self._data
+
+    def close(self):
+        self._data = None
+
+
+def ingest_upload(uploaded_file, default_name):
+    # Запись вложения из st.file_uploader; пустой файл — ошибка, как и раньше.
+    source = UploadSource(uploaded_file)
+    if not source.size:
+        raise ValueError('empty payload')
+    return {
+        'name': uploaded_file.name or default_name,
+        'size': source.size,
+        'source': source,
+    }
+
+
+def item_bytes(item) -> bytes:
+    data = item.get('data')
+    if data is None:
+        data = item['source'].read()
+    return data
+
+
+def release_items(files):
+    # отпустить исходники после того, как картинки встроены в документ
+    for item in files:
+        source = item.pop('source', None)
+        if source is not None:
+            source.close()
+        item.pop('data', None)